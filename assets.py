@@ -0,0 +1,89 @@
+import io
+import os
+import base64
+import threading
+import logging
+try: from PIL import Image
+except ImportError: Image = None # sin Pillow: se sirven los ficheros tal cual
+
+# ==============================================================================
+# ASSETS: IMÁGENES REDIMENSIONADAS + DATA URIS MEMORIZADOS (UNA VEZ POR PROCESO)
+# ==============================================================================
+# - Logos de marca (images/brands/*.png) a la miniatura que se pinta (30 px, x2 para pantallas HiDPI), indexados por nombre normalizado.
+# - Fondo del login recomprimido en JPEG (va bajo un velo al 85 %), logo del login a su ancho máximo.
+# Ningún rerun vuelve a leer disco ni a codificar base64.
+BRAND_DIR = os.path.join("images", "brands")
+LOGO_PX = 30; PIXEL_DENSITY = 2
+LOGIN_BG = ("fondo.png", 1280, "JPEG", 70) # (fichero, ancho máx., formato, calidad)
+LOGIN_LOGO = ("logo_blanc.png", 300 * PIXEL_DENSITY, "PNG", None)
+log = logging.getLogger(__name__)
+
+def brand_key(name): return str(name).lower().replace(" ", "")
+
+def _encode(path, max_w=None, max_h=None, fmt="PNG", quality=None):
+    # -> data URI (None si el fichero no existe o no se puede leer)
+    try:
+        if Image is None: raise OSError("Pillow no disponible")
+        with Image.open(path) as im:
+            im.load()
+            if im.mode == "P": im = im.convert("RGBA")
+            if fmt == "JPEG" and im.mode != "RGB": im = im.convert("RGB")
+            if max_w or max_h: im.thumbnail((max_w or im.width, max_h or im.height), Image.LANCZOS)
+            buf = io.BytesIO(); im.save(buf, fmt, optimize=True, **({"quality": quality} if quality else {}))
+            data = buf.getvalue(); mime = f"image/{fmt.lower()}"
+    except (OSError, ValueError) as e:
+        try:
+            with open(path, "rb") as f: data = f.read()
+            mime = "image/png"
+            if Image is not None: log.warning("Asset %s sin recomprimir: %s", path, e)
+        except OSError: return None
+    return f"data:{mime};base64,{base64.b64encode(data).decode()}"
+
+class AssetRegistry:
+    def __init__(self, root="."):
+        self.root = root; self.lock = threading.Lock(); self.uris = {}
+        brand_dir = os.path.join(root, BRAND_DIR)
+        files = sorted(f for f in os.listdir(brand_dir) if f.lower().endswith(".png")) if os.path.isdir(brand_dir) else []
+        self.brands = {brand_key(os.path.splitext(f)[0]): os.path.join(brand_dir, f) for f in files}
+
+    def _get(self, key, *encode_args):
+        with self.lock:
+            if key not in self.uris: self.uris[key] = _encode(*encode_args)
+            return self.uris[key]
+
+    def brand_logo(self, name):
+        path = self.brands.get(brand_key(name))
+        if not path: return None
+        return self._get(("brand", path), path, LOGO_PX * PIXEL_DENSITY, LOGO_PX * PIXEL_DENSITY, "PNG")
+
+    def login_background(self):
+        path, w, fmt, q = LOGIN_BG
+        return self._get(("bg", path), os.path.join(self.root, path), w, None, fmt, q)
+
+    def login_logo(self):
+        path, w, fmt, q = LOGIN_LOGO
+        return self._get(("logo", path), os.path.join(self.root, path), w, None, fmt, q)
+
+    def file_bytes(self, path):
+        # Para st.image / page_icon: bytes leídos una sola vez (None si no existe)
+        def read():
+            try:
+                with open(os.path.join(self.root, path), "rb") as f: return f.read()
+            except OSError: return None
+        with self.lock:
+            if ("file", path) not in self.uris: self.uris[("file", path)] = read()
+            return self.uris[("file", path)]
+
+    def warm(self):
+        # Todo codificado de una vez (arranque)
+        self.login_background(); self.login_logo()
+        for k in self.brands: self.brand_logo(k)
+        return self
+
+_registry = None; _registry_lock = threading.Lock()
+
+def get_registry():
+    global _registry
+    with _registry_lock:
+        if _registry is None: _registry = AssetRegistry().warm()
+        return _registry
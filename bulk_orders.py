@@ -0,0 +1,95 @@
+import json
+import time
+import pandas as pd
+import requests
+from data_engine import graphql_url, OrderBuffer, parse_product_node, enrich_orders, DEFAULT_PRODUCT, PRODUCT_FIELDS
+import product_cache
+import metrics
+from shopify_client import get_client
+
+# ==============================================================================
+# SHOPIFY BULK OPERATIONS: HISTÓRICO DE PEDIDOS (AÑOS COMPLETOS) EN UN SOLO JSONL
+# ==============================================================================
+# 1) bulkOperationRunQuery con pedidos + line items + metafields de producto
+# 2) sondeo de currentBulkOperation hasta COMPLETED
+# 3) lectura del JSONL línea a línea: cada pedido se normaliza en cuanto llegan todas sus líneas (nunca el fichero entero en memoria)
+BULK_POLL_SECONDS = 2.0
+BULK_TIMEOUT_SECONDS = 1800
+FULFILLMENT_MAP = {"FULFILLED": "fulfilled", "PARTIALLY_FULFILLED": "partial", "RESTOCKED": "restocked"}
+
+class BulkOperationError(RuntimeError): pass
+
+def _money(field): return f"{field}Set {{ shopMoney {{ amount currencyCode }} }}"
+
+def bulk_orders_query(created_at_min, created_at_max=None):
+    q = f"created_at:>='{pd.Timestamp(created_at_min).strftime('%Y-%m-%dT%H:%M:%S')}'"
+    if created_at_max is not None: q += f" AND created_at:<='{pd.Timestamp(created_at_max).strftime('%Y-%m-%dT%H:%M:%S')}'"
+    return f"""{{ orders(query: "{q}") {{ edges {{ node {{ id name createdAt updatedAt tags cancelledAt displayFinancialStatus displayFulfillmentStatus {_money("totalPrice")} {_money("totalDiscounts")} shippingAddress {{ countryCodeV2 }} lineItems {{ edges {{ node {{ id sku product {{ id {PRODUCT_FIELDS} }} }} }} }} }} }} }} }}"""
+
+def _gql(shop_url, token, query, variables=None):
+    payload, r = get_client(token).graphql(graphql_url(shop_url), query, variables)
+    if r.status_code != 200 or payload.get("errors"): raise BulkOperationError(f"GraphQL {r.status_code}: {payload.get('errors')}")
+    return payload["data"]
+
+def start_bulk_query(shop_url, token, inner_query):
+    data = _gql(shop_url, token, "mutation($q: String!) { bulkOperationRunQuery(query: $q) { bulkOperation { id status } userErrors { field message } } }", {"q": inner_query})
+    res = data["bulkOperationRunQuery"]
+    if res.get("userErrors"): raise BulkOperationError("; ".join(e["message"] for e in res["userErrors"]))
+    return res["bulkOperation"]["id"]
+
+def wait_bulk_result(shop_url, token, op_id, poll_seconds=BULK_POLL_SECONDS, timeout=BULK_TIMEOUT_SECONDS):
+    # -> url del JSONL (None si la consulta no devolvió nada)
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        op = _gql(shop_url, token, "{ currentBulkOperation { id status errorCode objectCount url } }")["currentBulkOperation"]
+        if not op or op["id"] != op_id: raise BulkOperationError(f"Bulk operation {op_id} ya no es la operación en curso")
+        if op["status"] == "COMPLETED": return op.get("url")
+        if op["status"] in ("FAILED", "CANCELED", "EXPIRED"): raise BulkOperationError(f"Bulk operation {op['status']}: {op.get('errorCode')}")
+        time.sleep(poll_seconds)
+    raise BulkOperationError(f"Bulk operation {op_id} sin terminar tras {timeout}s")
+
+def _gid_num(gid): return str(gid).rsplit("/", 1)[-1]
+
+def _to_rest_order(node, lines):
+    # Nodo GraphQL + sus line items -> mismo dict que la API REST (para reutilizar OrderBuffer)
+    price = (node.get("totalPriceSet") or {}).get("shopMoney") or {}; disc = (node.get("totalDiscountsSet") or {}).get("shopMoney") or {}
+    return {"id": int(_gid_num(node["id"])), "name": node["name"], "created_at": node["createdAt"], "updated_at": node.get("updatedAt"), "tags": ", ".join(node.get("tags") or []),
+            "cancelled_at": node.get("cancelledAt"), "financial_status": str(node.get("displayFinancialStatus") or "").lower() or None,
+            "fulfillment_status": FULFILLMENT_MAP.get(node.get("displayFulfillmentStatus")), "total_price": price.get("amount", "0"), "currency": price.get("currencyCode", "EUR"),
+            "total_discounts": disc.get("amount", "0"), "shipping_address": {"country_code": (node.get("shippingAddress") or {}).get("countryCodeV2", "Autre")},
+            "line_items": [{"sku": li.get("sku") or "", "product_id": _gid_num(li["product"]["id"]) if li.get("product") else None} for li in lines]}
+
+def iter_bulk_orders(lines):
+    # Flujo de líneas JSONL -> (pedido estilo REST, {pid: nodo producto}) por pedido. Los hijos llevan __parentId y siguen a su padre.
+    current = None; children = []; products = {}
+    for raw in lines:
+        if not raw: continue
+        obj = json.loads(raw)
+        if "__parentId" in obj:
+            children.append(obj)
+            if obj.get("product"): products[_gid_num(obj["product"]["id"])] = obj["product"]
+            continue
+        if current is not None: yield _to_rest_order(current, children), products
+        current = obj; children = []; products = {}
+    if current is not None: yield _to_rest_order(current, children), products
+
+def load_orders_bulk(shop_url, token, created_at_min, created_at_max=None, poll_seconds=BULK_POLL_SECONDS, db_path=None):
+    # -> (df normalizado y enriquecido, ids de pedidos descartados). Los productos del JSONL alimentan también la caché de producto.
+    with metrics.span("bulk.wait"):
+        op_id = start_bulk_query(shop_url, token, bulk_orders_query(created_at_min, created_at_max))
+        url = wait_bulk_result(shop_url, token, op_id, poll_seconds)
+    buf = OrderBuffer(); COST_MAP = {}
+    if url:
+        with metrics.span("bulk.download") as sp, get_client(token).download(url) as r:
+            r.raise_for_status()
+            for order, products in iter_bulk_orders(r.iter_lines(decode_unicode=True)):
+                sp["orders"] += 1
+                for pid, node in products.items():
+                    if pid not in COST_MAP:
+                        try: COST_MAP[pid] = parse_product_node(node)
+                        except (KeyError, TypeError, ValueError): COST_MAP[pid] = dict(DEFAULT_PRODUCT)
+                buf.extend((order,))
+    product_cache.store(COST_MAP, db_path)
+    df_ord = buf.frame()
+    if not df_ord.empty: df_ord = enrich_orders(df_ord, COST_MAP)
+    return df_ord, buf.dropped
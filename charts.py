@@ -0,0 +1,124 @@
+import hashlib
+import functools
+import threading
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+import metrics
+from assets import get_registry
+
+# ==============================================================================
+# GRÁFICOS (PALETA + BARRAS), FUERA DEL SCRIPT PARA PODER MEDIRLOS SIN STREAMLIT
+# ==============================================================================
+# plotly se importa en la primera figura: importar la paleta (C_*) no lo carga.
+# Figuras memorizadas por proceso (todas las sesiones): clave = hash del frame agregado (pequeño) + opciones del gráfico,
+# LRU de FIGURE_CACHE_MAX. Una figura servida de la caché es compartida: no se modifica después de devolverla.
+FIGURE_CACHE_MAX = 128
+# COULEURS
+C_MAIN = "#0a4650"
+C_SEC = "#08e394"
+C_TER = "#dcff54"
+C_SOFT = "#e0fdf4"
+C_DECATHLON = "#0292e9"
+C_ALERT = "#ef4444"
+C_BG = "#ffffff"
+C_GRAY_LIGHT = "#f8f9fa"
+
+class FigureCache:
+    def __init__(self, maxsize=FIGURE_CACHE_MAX):
+        self.maxsize = maxsize; self.lock = threading.Lock(); self.figs = OrderedDict()
+
+    @staticmethod
+    def key(name, df, opts):
+        h = hashlib.sha1(pd.util.hash_pandas_object(df, index=True).to_numpy().tobytes())
+        h.update(repr((list(df.columns), [str(t) for t in df.dtypes], opts)).encode())
+        return name, h.hexdigest()
+
+    def get(self, name, df, opts, build):
+        k = self.key(name, df, opts)
+        with self.lock:
+            fig = self.figs.get(k)
+            if fig is not None: self.figs.move_to_end(k)
+        if fig is not None: metrics.record("figure.cache", 0.0, label=name, hits=1); return fig
+        fig = build()
+        with self.lock:
+            self.figs[k] = fig
+            while len(self.figs) > self.maxsize: self.figs.popitem(last=False)
+        return fig
+
+    def clear(self):
+        with self.lock: self.figs.clear()
+
+FIGURES = FigureCache()
+
+def cached_figure(name):
+    # Decorador: el primer argumento es el frame agregado; el resto, opciones hashables por repr
+    def deco(fn):
+        @functools.wraps(fn)
+        def wrapper(df, *args, **kw): return FIGURES.get(name, df, (args, sorted(kw.items())), lambda: fn(df, *args, **kw))
+        return wrapper
+    return deco
+
+@cached_figure("bar")
+@metrics.timed("figure.build")
+def plot_bar_smart(df, x_col, y_col, color_col=None, colors=None, orientation='v', strict_order=None, limit=None, show_logos=False):
+    import plotly.graph_objects as go
+    if df.empty: return go.Figure()
+    if limit: df = df.head(limit)
+    final_colors = np.where(df[x_col].astype(str).str.contains("Decathlon", regex=False), C_DECATHLON, C_MAIN).tolist() if show_logos and x_col == "mp_name" else [C_MAIN] * len(df)
+    if strict_order: df = df.set_index(x_col).reindex(strict_order).fillna(0).reset_index()
+    else: df = df.sort_values(by=y_col, ascending=(True if orientation == 'h' else False))
+    total = df[y_col].sum(); total = 1 if total == 0 else total
+    pct = (df[y_col] / total * 100).round(1)
+    df = df.assign(pct=pct, text_inside=np.where(df[y_col] > 0, "<b>" + pct.astype(str) + "%</b>", ""))
+    if orientation == 'h' and show_logos:
+        assets = get_registry()
+        df["y_label"] = [f"<img src='{uri}' width='30' height='30' style='vertical-align:middle; margin-right:5px;'> <b>{name}</b>" if (uri := assets.brand_logo(name)) else f"<b>{name}</b>" for name in df[x_col]]
+        x_col_plot = "y_label"
+    else: x_col_plot = x_col
+    shown = df[df[y_col] > 0]; counts = [f"<b>{int(v)}</b>" for v in shown[y_col]]
+    fig = go.Figure()
+    if orientation == 'v':
+        fig.add_trace(go.Bar(x=df[x_col], y=df[y_col], text=df["text_inside"], textposition='inside', marker_color=final_colors, textfont=dict(size=14, color='white')))
+        fig.update_layout(uniformtext_minsize=12, uniformtext_mode='hide', margin=dict(t=40,b=20,l=0,r=0), height=400, xaxis_title=None, yaxis_title=None)
+        fig.update_yaxes(range=[0, df[y_col].max() * 1.15])
+        fig.update_layout(annotations=[dict(x=x, y=y, text=txt, yshift=15, showarrow=False, font=dict(size=16, color="black")) for x, y, txt in zip(shown[x_col], shown[y_col], counts)])
+    else:
+        fig.add_trace(go.Bar(y=df[x_col_plot], x=df[y_col], text=df["text_inside"], textposition='inside', orientation='h', marker_color=final_colors, textfont=dict(size=12, color='white')))
+        fig.update_layout(margin=dict(t=20,b=20,l=0,r=20), height=400 + (len(df)*10), xaxis_title=None, yaxis_title=None)
+        max_x = df[y_col].max() * 1.15
+        fig.update_xaxes(range=[0, max_x]); fig.update_yaxes(tickmode='array', tickvals=df[x_col_plot], ticktext=df[x_col_plot])
+        fig.update_layout(annotations=[dict(y=y, x=x, text=txt, xshift=25, showarrow=False, font=dict(size=14, color="black")) for y, x, txt in zip(shown[x_col_plot], shown[y_col], counts)])
+    return fig
+
+# --- EVOLUCIÓN ---
+@cached_figure("evol.month")
+@metrics.timed("figure.build")
+def plot_month_evolution(daily):
+    # daily: label, ingresos, margen, ventas (un día por fila)
+    import plotly.graph_objects as go
+    from plotly.subplots import make_subplots
+    fig_ev = make_subplots(specs=[[{"secondary_y": True}]]); fig_ev.add_trace(go.Scatter(x=daily["label"], y=daily["ingresos"], name="Ingresos (€)", line=dict(color=C_TER, shape='spline'), mode='lines+markers'), secondary_y=False); fig_ev.add_trace(go.Scatter(x=daily["label"], y=daily["margen"], name="Margen (€)", line=dict(color=C_SEC, shape='spline'), mode='lines+markers'), secondary_y=False); fig_ev.add_trace(go.Scatter(x=daily["label"], y=daily["ventas"], name="Ventas (#)", line=dict(color=C_MAIN, shape='spline', dash='dot'), mode='lines+markers'), secondary_y=True); fig_ev.update_layout(height=450, margin=dict(l=0, r=0, t=10, b=0), hovermode="x unified", legend=dict(orientation="h", y=1.1)); fig_ev.update_yaxes(title_text="€", secondary_y=False, showgrid=True, gridcolor='#eee'); fig_ev.update_yaxes(title_text="#", secondary_y=True, showgrid=False)
+    return fig_ev
+
+@cached_figure("evol.year")
+@metrics.timed("figure.build")
+def plot_year_evolution(annual_stats, tick_vals, tick_text):
+    # annual_stats: month, ingresos, margen, ventas (12 filas)
+    import plotly.graph_objects as go
+    from plotly.subplots import make_subplots
+    fig_yr = make_subplots(specs=[[{"secondary_y": True}]]); 
+    fig_yr.add_trace(go.Bar(x=annual_stats["month"], y=annual_stats["ingresos"], name="Ingresos (€)", marker_color=C_TER, opacity=0.6), secondary_y=False)
+    fig_yr.add_trace(go.Scatter(x=annual_stats["month"], y=annual_stats["margen"], name="Margen (€)", line=dict(color=C_SEC, width=3, shape='spline'), mode='lines+markers'), secondary_y=False)
+    fig_yr.add_trace(go.Scatter(x=annual_stats["month"], y=annual_stats["ventas"], name="Ventas (#)", line=dict(color=C_MAIN, width=3, shape='spline', dash='dot'), mode='lines+markers'), secondary_y=True)
+    fig_yr.update_layout(height=450, hovermode="x unified", xaxis=dict(tickmode='array', tickvals=tick_vals, ticktext=tick_text)); fig_yr.update_yaxes(title_text="€", secondary_y=False, showgrid=True); fig_yr.update_yaxes(title_text="#", secondary_y=True, showgrid=False)
+    return fig_yr
+
+@cached_figure("evol.lines")
+@metrics.timed("figure.build")
+def plot_year_lines(df, color, color_map, tick_vals, tick_text):
+    # df: month, <color>, count
+    import plotly.express as px
+    fig = px.line(df, x="month", y="count", color=color, markers=True, color_discrete_map=color_map)
+    fig.update_layout(height=400, xaxis_title=None, yaxis_title="Ventas (#)", hovermode="x unified", xaxis=dict(tickmode='array', tickvals=tick_vals, ticktext=tick_text, range=[0.5, 12.5]))
+    return fig
@@ -0,0 +1,377 @@
+import os
+import pandas as pd
+import numpy as np
+import requests
+import re
+import time
+import logging
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from datetime import datetime, timedelta
+from urllib.parse import urlencode
+import product_cache
+import metrics
+from shopify_client import get_client
+
+# ==============================================================================
+# MOTEUR DATA (SHOPIFY -> DATAFRAMES)
+# ==============================================================================
+API_VERSION = "2024-01"
+EXCHANGE_RATES = {
+    "EUR": 1.0, "PLN": 0.232, "HUF": 0.0025, "SEK": 0.088, "DKK": 0.134,
+    "GBP": 1.17, "CZK": 0.039, "USD": 0.92, "CHF": 1.06,
+    "RON": 0.201, "BGN": 0.511, "HRK": 0.132, "NOK": 0.087
+}
+MP_KEYWORDS = ["decathlon", "alltricks", "refurbed", "campsider", "ebikemood", "bikeroom", "troc", "cycle tyre", "cycletyre", "buycycle", "bikeflip"]
+MP_CLEAN_NAMES = {"decathlon": "Decathlon", "alltricks": "Alltricks"}
+TAG_RE = re.compile("|".join(map(re.escape, MP_KEYWORDS + ["marketplace", "venta asistida"]))) # una pasada por pedido en lugar de un bucle de palabras
+MP_RANK = {k: i for i, k in enumerate(MP_KEYWORDS)}
+DEFAULT_PRODUCT = {"cost": 0.0, "fiscal": "PRO", "brand": "Autre", "cat": "Autre", "subcat": "-", "type": "Muscular", "created_at": None}
+ENRICH_COLS = ["cost", "fiscal", "margin_real", "brand", "cat", "subcat", "type", "rotation", "commission"]
+
+def shop_base(shop_url): return shop_url.rstrip("/") if "://" in shop_url else f"https://{shop_url}" # "http://127.0.0.1:8765" pour le fake local
+def rest_url(shop_url, path): return f"{shop_base(shop_url)}/admin/api/{API_VERSION}/{path}"
+def graphql_url(shop_url): return rest_url(shop_url, "graphql.json")
+
+def parse_money(raw):
+    try: return float(re.sub(r'[^\d.]', '', str(raw).replace(',','.'))) if raw else 0.0
+    except: return 0.0
+
+# --- PEDIDOS (REST) ---
+def fetch_orders(shop_url, token, created_at_min=None, created_at_max=None, updated_at_min=None, sink=None):
+    # Devuelve (pedidos, completo). "completo" es False si la paginación se cortó: el llamador no debe avanzar su marca de sincronización.
+    # sink (OrderBuffer): cada página se normaliza al llegar y su JSON se suelta; se devuelve el sink en lugar de la lista.
+    params = {"status": "any", "limit": 250, "order": "created_at desc"}
+    for k, v in (("created_at_min", created_at_min), ("created_at_max", created_at_max), ("updated_at_min", updated_at_min)):
+        if v is not None: params[k] = pd.Timestamp(v).replace(microsecond=0).isoformat()
+    url_o = rest_url(shop_url, f"orders.json?{urlencode(params)}"); orders = sink if sink is not None else []
+    with metrics.span("orders.fetch") as sp:
+        while url_o:
+            try: r = get_client(token).get(url_o)
+            except requests.RequestException: return orders, False
+            sp["pages"] += 1; sp["bytes"] += len(r.content)
+            if r.status_code != 200: sp["errors"] += 1; return orders, False
+            page = r.json().get("orders", []); orders.extend(page); sp["orders"] += len(page)
+            url_o = r.links['next']['url'] if 'next' in r.links else None
+    return orders, True
+
+# Rango largo -> tramos [lo, hi) con su propio cursor created_at_min/max, descargados en paralelo (el cliente respeta el cubo REST y los 429)
+ORDER_SHARD_FREQ = "MS" # inicio de mes; "W-MON" para semanas
+ORDER_FETCH_WORKERS = int(os.environ.get("TUVALUM_FETCH_WORKERS", 4))
+
+def order_shards(start, end=None, freq=ORDER_SHARD_FREQ):
+    # -> [(lo, hi), ...] contiguos de start a end, cortados en los límites de freq (hi None = abierto hasta ahora)
+    start = pd.Timestamp(start); end = pd.Timestamp(end) if end is not None else None
+    cuts = [c for c in pd.date_range(start, end if end is not None else pd.Timestamp.now(tz=start.tz), freq=freq) if c > start and (end is None or c < end)]
+    bounds = [start] + cuts + [end]
+    return list(zip(bounds[:-1], bounds[1:]))
+
+def fetch_orders_sharded(shop_url, token, shards, workers=ORDER_FETCH_WORKERS, sink=None):
+    # -> {(lo, hi): (pedidos, completo)}. created_at_max es inclusivo en Shopify: el tramo acaba un segundo antes de hi.
+    # Con sink todos los tramos normalizan en el mismo OrderBuffer (los tramos no se solapan).
+    def fetch(shard):
+        lo, hi = shard
+        return fetch_orders(shop_url, token, created_at_min=lo, created_at_max=hi - pd.Timedelta(seconds=1) if hi is not None else None, sink=sink)
+    if not shards: return {}
+    with metrics.span("orders.fetch_sharded", shards=len(shards)), ThreadPoolExecutor(max_workers=max(1, min(workers, len(shards)))) as ex:
+        return dict(zip(shards, ex.map(fetch, shards)))
+
+# --- NORMALIZACIÓN EN FLUJO (PÁGINA A PÁGINA -> COLUMNAS) ---
+ORDER_FIELDS = ["order_id", "updated_at", "date", "total_ttc", "status", "channel", "mp_name", "clean_mp", "order_name", "parent_id", "country", "sku", "discount", "currency_code", "raw_price_val"]
+
+def classify_tags(tags):
+    # -> (canal, mp, mp limpio). Varias palabras MP en las etiquetas: gana la primera de MP_KEYWORDS.
+    found = set(TAG_RE.findall((tags or "").lower())); c = "Online"; mp = "-"; mp_clean_name = "Autre MP"
+    k = min(found & MP_RANK.keys(), key=MP_RANK.get, default=None)
+    if k: c = "Marketplace"; mp = k.capitalize(); mp_clean_name = MP_CLEAN_NAMES.get(k, mp)
+    elif "marketplace" in found: c = "Marketplace"; mp = "Autre MP"
+    if "venta asistida" in found: c = "Tienda"
+    return c, mp, mp_clean_name
+
+def order_values(o):
+    # Pedido REST -> valores en el orden de ORDER_FIELDS, con created_at aún en texto (None si el pedido no cuenta: cancelado, reembolsado, < 200 €)
+    fin_status = o.get("financial_status"); fulfill = o.get("fulfillment_status")
+    if fin_status == "partially_refunded": fin_status = "paid"
+    if fin_status == "refunded" and fulfill != "unfulfilled": return None
+    raw_price = float(o["total_price"]); currency = o.get("currency", "EUR")
+    if currency == "EUR": total_eur = raw_price
+    else:
+        rate = EXCHANGE_RATES.get(currency); total_eur = raw_price * rate if rate else 0.0
+    if o.get("cancelled_at") or total_eur < 200.0: return None
+    try: total_discount = float(o.get("total_discounts", 0.0))
+    except: total_discount = 0.0
+    pid = None; sku = ""
+    if o.get("line_items"):
+        for line in o["line_items"]:
+            s = line.get("sku", "")
+            if s and len(s) == 6 and (s.startswith("2") or s.startswith("5")): sku = s; pid = str(line.get("product_id") or ""); break
+        if not pid and o["line_items"]: line = o["line_items"][0]; pid = str(line.get("product_id") or ""); sku = line.get("sku", "")
+    c, mp, mp_clean_name = classify_tags(o.get("tags"))
+    country = (o.get("shipping_address") or {}).get("country_code", "Autre")
+    return (int(o["id"]), o.get("updated_at") or o["created_at"], o["created_at"], total_eur, fin_status, c, mp, mp_clean_name, o["name"], pid, country, sku, -total_discount, currency, raw_price)
+
+def local_dates(values):
+    # created_at ISO (con o sin zona; sin zona = UTC) -> hora de Madrid sin zona, de una vez para toda la columna
+    return pd.to_datetime(values, utc=True, format="ISO8601").tz_convert("Europe/Madrid").tz_localize(None)
+
+class OrderBuffer:
+    # Pedidos normalizados en columnas (listas) a medida que llegan las páginas: el JSON crudo de cada página se suelta en cuanto se ha leído.
+    # extend() es seguro entre hilos (tramos en paralelo); la conversión de fechas se hace una sola vez en frame().
+    def __init__(self):
+        self.cols = [[] for _ in ORDER_FIELDS]; self.dropped = []; self.seen = 0; self.lock = threading.Lock()
+
+    def __len__(self): return self.seen
+
+    def extend(self, orders):
+        rows = []; dropped = []
+        for o in orders:
+            v = order_values(o)
+            if v is None: dropped.append(int(o["id"]))
+            else: rows.append(v)
+        with self.lock:
+            self.seen += len(orders); self.dropped.extend(dropped)
+            for col, vals in zip(self.cols, zip(*rows)): col.extend(vals)
+        return self
+
+    def frame(self):
+        if not self.cols[0]: return pd.DataFrame()
+        cols = dict(zip(ORDER_FIELDS, self.cols)); cols["date"] = local_dates(cols["date"])
+        return pd.DataFrame(cols)
+
+def format_raw_price(raw_price_val, currency_code):
+    # "1,234.00 PLN" tal como se cobró: sólo para las filas que se muestran (Tabla Ventas), no se guarda en el frame
+    return [f"{v:,.2f} {c}" for v, c in zip(raw_price_val, currency_code)]
+
+# --- PRODUCTOS (GRAPHQL) ---
+# Enriquecimiento concurrente: varios chunks en vuelo a la vez, tamaño y número de chunks
+# adaptados al coste disponible que devuelve Shopify (extensions.cost.throttleStatus).
+# Un chunk throttled o fallido se reintenta; si agota los intentos sus productos quedan fuera del mapa (nunca coste 0 silencioso)
+# y se apuntan como fallidos en la caché de producto: no se vuelven a pedir hasta PRODUCT_FAILED_TTL.
+GQL_MAX_WORKERS = 4; GQL_CHUNK_MIN = 5; GQL_CHUNK_MAX = 50; GQL_MAX_ATTEMPTS = 5
+PRODUCT_FIELDS = """title vendor createdAt updatedAt metafield(namespace: "custom", key: "custitem_preciocompra") { value } fiscal: metafield(namespace: "custom", key: "cseg_origenfiscal") { value } modal: metafield(namespace: "custom", key: "cseg_modalidad") { value } subcat: metafield(namespace: "custom", key: "cseg_subcategoria") { value } km: metafield(namespace: "custom", key: "custitem_kilometraje") { value } motor: metafield(namespace: "custom", key: "cseg_motor") { value } brand_real: metafield(namespace: "custom", key: "cseg_all_marca") { value }"""
+log = logging.getLogger(__name__)
+
+def parse_product_node(n):
+    raw_cost = n["metafield"]["value"] if n["metafield"] else "0"
+    cost_val = float(re.sub(r'[^\d.]', '', str(raw_cost).replace(',','.'))) if raw_cost else 0.0
+    fiscal_val = n["fiscal"]["value"] if n["fiscal"] else "PRO"
+    # MARQUE (CLEANING STRICT)
+    brand_raw = n["brand_real"]["value"] if (n.get("brand_real") and n["brand_real"]["value"]) else (n["vendor"] if n["vendor"] else "Autre")
+    brand_val = str(brand_raw).strip().upper() # Nettoyage ici
+    # CHAMPS CATEGORIE
+    subcat_raw = n["subcat"]["value"] if (n.get("subcat") and n["subcat"]["value"]) else "-"
+    km_raw = n["km"]["value"] if (n.get("km") and n["km"]["value"]) else "0"
+    motor_raw = n["motor"]["value"] if (n.get("motor") and n["motor"]["value"]) else "-"
+    # LOGIQUE TYPE E-BIKE (DETECTION)
+    type_final = "Muscular"
+    try:
+        if (motor_raw != "-" and motor_raw is not None): type_final = "E-Bike"
+        elif float(km_raw) > 1: type_final = "E-Bike"
+    except: pass
+    # LOGIQUE CATEGORIE
+    cat_final = "Autre"; s_low = str(subcat_raw).lower()
+    if "carretera" in s_low or "gravel" in s_low: cat_final = "Road"
+    elif "doble" in s_low or "rigid" in s_low or "mtb" in s_low: cat_final = "MTB"
+    if type_final == "E-Bike": cat_final = "E-Bike"
+    created_at = pd.to_datetime(n["createdAt"]).tz_convert(None)
+    return {"cost": cost_val, "fiscal": fiscal_val, "brand": brand_val, "cat": cat_final, "subcat": subcat_raw, "type": type_final, "created_at": created_at, "updated_at": n.get("updatedAt")}
+
+class QueryBudget:
+    # Estimación local del cubo de coste GraphQL (leaky bucket), corregida con cada throttleStatus recibido
+    def __init__(self, max_workers=GQL_MAX_WORKERS):
+        self.lock = threading.Lock(); self.max_workers = max_workers
+        self.available = 1000.0; self.maximum = 1000.0; self.restore = 50.0; self.per_product = 4.0; self.stamp = time.monotonic()
+    def _estimate(self): return min(self.maximum, self.available + (time.monotonic() - self.stamp) * self.restore)
+    def update(self, ext, n_products=0):
+        cost = (ext or {}).get("cost") or {}; ts = cost.get("throttleStatus") or {}
+        with self.lock:
+            if ts:
+                self.available = float(ts.get("currentlyAvailable", self.available)); self.maximum = float(ts.get("maximumAvailable", self.maximum)); self.restore = float(ts.get("restoreRate", self.restore)) or self.restore; self.stamp = time.monotonic()
+            if n_products and cost.get("requestedQueryCost"): self.per_product = max(1.0, (float(cost["requestedQueryCost"]) - 1) / n_products)
+    def acquire(self, cost):
+        # Reserva coste antes de enviar; espera lo justo para que el cubo se rellene
+        while True:
+            with self.lock:
+                est = self._estimate()
+                if est >= cost: self.available = est - cost; self.stamp = time.monotonic(); return
+                delay = (cost - est) / self.restore
+            time.sleep(delay)
+    def chunk_size(self):
+        with self.lock: share = self._estimate() / max(1, self.max_workers)
+        return int(min(GQL_CHUNK_MAX, max(GQL_CHUNK_MIN, (share - 1) // self.per_product)))
+    def slots(self):
+        with self.lock: return int(min(self.max_workers, max(1, self._estimate() // (self.per_product * GQL_CHUNK_MIN + 1))))
+
+def _fetch_products_chunk(chunk, shop_url, token, budget):
+    query = "{" + " ".join(f'p{idx}: product(id: "gid://shopify/Product/{pid}") {{ {PRODUCT_FIELDS} }}' for idx, pid in enumerate(chunk)) + "}"
+    for attempt in range(GQL_MAX_ATTEMPTS):
+        budget.acquire(budget.per_product * len(chunk) + 1)
+        try: payload, r = get_client(token).graphql(graphql_url(shop_url), query)
+        except (requests.RequestException, ValueError):
+            time.sleep(0.5 * 2 ** attempt); continue
+        budget.update(payload.get("extensions"), len(chunk))
+        errors = payload.get("errors") or []
+        if any((e.get("extensions") or {}).get("code") == "THROTTLED" for e in errors if isinstance(e, dict)):
+            metrics.record("shopify.graphql.throttled", 0.0); continue
+        data = payload.get("data")
+        if r.status_code != 200 or not data:
+            time.sleep(0.5 * 2 ** attempt); continue
+        return {pid: (parse_product_node(data[f"p{idx}"]) if data.get(f"p{idx}") else dict(DEFAULT_PRODUCT, updated_at="")) for idx, pid in enumerate(chunk)}
+    log.warning("Enriquecimiento GraphQL: %d productos sin datos tras %d intentos", len(chunk), GQL_MAX_ATTEMPTS)
+    return {}
+
+def _fetch_products_remote(prod_id_list, shop_url, token, max_workers=GQL_MAX_WORKERS):
+    # Devuelve {pid: datos}. Los pid ausentes del resultado son fallos definitivos, no productos sin coste.
+    if not prod_id_list: return {}
+    remaining = deque(dict.fromkeys(prod_id_list)); DATA_MAP = {}; budget = QueryBudget(max_workers); running = set()
+    with metrics.span("products.enrich", products=len(remaining)), ThreadPoolExecutor(max_workers=max_workers) as ex:
+        while remaining or running:
+            while remaining and len(running) < budget.slots():
+                chunk = [remaining.popleft() for _ in range(min(budget.chunk_size(), len(remaining)))]
+                running.add(ex.submit(_fetch_products_chunk, chunk, shop_url, token, budget))
+            done, running = wait(running, return_when=FIRST_COMPLETED)
+            for f in done: DATA_MAP.update(f.result())
+    return DATA_MAP
+
+@metrics.timed("products.revalidate")
+def fetch_updated_at(prod_id_list, shop_url, token):
+    # Revalidación barata: sólo id + updatedAt (250 nodos por consulta). None para un chunk que falló.
+    result = {}; ids = list(prod_id_list)
+    for i in range(0, len(ids), 250):
+        chunk = ids[i:i + 250]; gids = ", ".join(f'"gid://shopify/Product/{pid}"' for pid in chunk)
+        try:
+            payload, _ = get_client(token).graphql(graphql_url(shop_url), f"{{ nodes(ids: [{gids}]) {{ ... on Product {{ id updatedAt }} }} }}")
+            for n in (payload.get("data") or {}).get("nodes") or []:
+                if n: result[n["id"].rsplit("/", 1)[-1]] = n["updatedAt"]
+            for pid in chunk: result.setdefault(pid, "")
+        except (requests.RequestException, ValueError, KeyError, AttributeError):
+            for pid in chunk: result[pid] = None
+    return result
+
+def fetch_product_details_batch(prod_id_list, shop_url, token, max_workers=GQL_MAX_WORKERS, db_path=None):
+    # Caché de producto primero: frescos sin llamada, caducados revalidados por updatedAt, fallidos recientes fuera, el resto a GraphQL.
+    if not prod_id_list: return {}
+    ids = [str(p) for p in dict.fromkeys(prod_id_list)]
+    fresh, stale = product_cache.lookup(ids, db_path); DATA_MAP = dict(fresh)
+    to_fetch = [pid for pid in ids if pid not in fresh and pid not in stale]
+    given_up = product_cache.failed(to_fetch, db_path); to_fetch = [pid for pid in to_fetch if pid not in given_up]
+    if stale:
+        current = fetch_updated_at(list(stale), shop_url, token)
+        unchanged = [pid for pid, (d, upd) in stale.items() if current.get(pid) == upd]
+        product_cache.mark_revalidated(unchanged, db_path)
+        for pid in unchanged: DATA_MAP[pid] = stale[pid][0]
+        to_fetch += [pid for pid in stale if pid not in DATA_MAP]
+    fetched = _fetch_products_remote(to_fetch, shop_url, token, max_workers)
+    product_cache.store(fetched, db_path); DATA_MAP.update(fetched)
+    product_cache.mark_failed([pid for pid in to_fetch if pid not in fetched and pid not in stale], db_path)
+    for pid in stale: DATA_MAP.setdefault(pid, stale[pid][0]) # Shopify KO: mejor el dato anterior que un coste 0
+    return DATA_MAP
+
+def cache_product_nodes(nodes, db_path=None):
+    # Nodos de producto completos (inventario, búsqueda SKU) -> caché de producto, con lo que la calculadora necesita para no volver a pedirlos
+    products = {}
+    for node in nodes:
+        if not node.get("id") or not node.get("updatedAt"): continue
+        try: d = parse_product_node(node)
+        except (KeyError, TypeError, ValueError): continue
+        v_edges = (node.get("variants") or {}).get("edges") or []
+        if v_edges: d["sku"] = v_edges[0]["node"].get("sku"); d["price"] = v_edges[0]["node"].get("price")
+        d["title"] = node.get("title"); d["img"] = (node.get("featuredImage") or {}).get("url"); d["specs"] = parse_specs(node) if "m_state" in node else None
+        products[node["id"].rsplit("/", 1)[-1]] = d
+    product_cache.store(products, db_path)
+
+# --- BÚSQUEDA POR SKU (CALCULADORA) ---
+SPEC_FIELDS = """m_state: metafield(namespace: "custom", key: "custitem_all_estado") { value } m_year: metafield(namespace: "custom", key: "custitem_all_anodelmodelo") { value } m_size: metafield(namespace: "custom", key: "cseg_talla") { value } m_size_rec: metafield(namespace: "custom", key: "cseg_tallaalturacic") { value } m_frame: metafield(namespace: "custom", key: "custitem_all_materialdelcuadro") { value } m_wheels: metafield(namespace: "custom", key: "custitem_all_materialrueda") { value } m_speed: metafield(namespace: "custom", key: "cseg_cambiotrasero") { value } m_speed_cass: metafield(namespace: "custom", key: "custitem_all_veldelcassette") { value } m_plate: metafield(namespace: "custom", key: "cseg_desarrolloplat") { value } m_brakes: metafield(namespace: "custom", key: "cseg_tipodefrenos") { value } m_motor: metafield(namespace: "custom", key: "cseg_motor") { value } m_battery: metafield(namespace: "custom", key: "cseg_capacidadbater") { value } m_km: metafield(namespace: "custom", key: "custitem_kilometraje") { value }"""
+
+def parse_specs(n):
+    inv = n.get("totalInventory", 0)
+    def gv(k): return n[k]["value"] if n.get(k) else "-"
+    specs = {"state": gv("m_state"), "year": gv("m_year"), "size": f"{gv('m_size')} ({gv('m_size_rec')})", "frame": gv("m_frame"), "wheels": f"{gv('m_wheels')}", "group": f"{gv('m_speed')} ({gv('m_speed_cass')}) - {gv('m_plate')}", "brakes": gv("m_brakes"), "ebike": None, "inv": inv}; motor = gv("m_motor")
+    if motor != "-": specs["ebike"] = f"{motor} - {gv('m_battery')} Wh ({gv('m_km')} km)"
+    return specs
+
+@metrics.timed("sku.live")
+def search_sku_live(sku, shop_url, token):
+    q = f"""{{ products(first: 1, query: "sku:{sku}") {{ edges {{ node {{ id totalInventory featuredImage {{ url }} {PRODUCT_FIELDS} {SPEC_FIELDS} variants(first: 1) {{ edges {{ node {{ price sku }} }} }} }} }} }} }}"""
+    try:
+        payload, _ = get_client(token).graphql(graphql_url(shop_url), q); d = payload.get("data",{}).get("products",{}).get("edges",[])
+        if d:
+            n = d[0]["node"]; cache_product_nodes([n]); raw_c = n["metafield"]["value"] if n["metafield"] else "0"; cost = float(re.sub(r'[^\d.]', '', str(raw_c).replace(',','.'))) if raw_c else 0.0; v_node = n["variants"]["edges"][0]["node"]; price = float(v_node["price"])
+            fiscal = n["fiscal"]["value"] if n["fiscal"] else "PRO"
+            return {"found": True, "title": n["title"], "cost": cost, "price": price, "created_at": pd.to_datetime(n["createdAt"]).tz_convert(None), "fiscal": fiscal, "img": n["featuredImage"]["url"] if n["featuredImage"] else None, "specs": parse_specs(n)}
+    except: pass
+    return {"found": False}
+
+# --- MARGENES ---
+# Reglas de comisión marketplace: (palabra clave en mp_name, divisa o None = cualquiera, tasa, tope en divisa local o None).
+# Se aplica la primera regla que encaja; por eso las reglas con divisa van antes que su comodín.
+COMMISSION_RULES = [
+    ("alltricks", "EUR", 0.10, 150.0),
+    ("alltricks", None, 0.10, None),
+    ("decathlon", "PLN", 0.11, 1210.0),
+    ("decathlon", "RON", 0.11, 1320.0),
+    ("decathlon", "HUF", 0.11, 10450.0),
+    ("decathlon", None, 0.11, 275.0),
+    ("campsider", None, 0.10, None),
+    ("refurbed", None, 0.10, None),
+    ("ebikemood", None, 0.06, None),
+]
+DEFAULT_MP_RATE = 0.10
+
+def compute_commission(df_ord):
+    # Comisión en EUR por pedido, en operaciones de columna (0 fuera de Marketplace)
+    is_mp = (df_ord["channel"] == "Marketplace").to_numpy()
+    mp_low = df_ord["mp_name"].astype(str).str.lower(); curr = df_ord["currency_code"]
+    rate = np.full(len(df_ord), DEFAULT_MP_RATE); cap = np.full(len(df_ord), np.inf); free = is_mp.copy()
+    for key, currency, r, c in COMMISSION_RULES:
+        m = free & mp_low.str.contains(key, regex=False).to_numpy()
+        if currency: m &= (curr == currency).to_numpy()
+        rate[m] = r; cap[m] = np.inf if c is None else c; free &= ~m
+    comm = np.minimum(df_ord["raw_price_val"].to_numpy(dtype=float) * rate, cap)
+    fx = np.where(curr == "EUR", 1.0, curr.map(EXCHANGE_RATES).fillna(0.0).to_numpy(dtype=float))
+    return np.where(is_mp, comm * fx, 0.0)
+
+def compute_margin(price, cost, fiscal, commission):
+    # REBU: (PVP - coste)/1.21 · INTRA: PVP - coste · PRO: PVP/1.21 - coste/1.21 ; 0 si no hay coste
+    price = np.asarray(price, dtype=float); cost = np.asarray(cost, dtype=float); fiscal = pd.Series(fiscal).astype(str).str.upper()
+    is_rebu = fiscal.str.contains("REBU", regex=False).to_numpy(); is_intra = fiscal.str.contains("INTRA", regex=False).to_numpy()
+    base = np.where(is_rebu, (price - cost) / 1.21, np.where(is_intra, price - cost, (price / 1.21) - (cost / 1.21)))
+    return np.where(cost > 0, base - commission, 0.0)
+
+@metrics.timed("orders.margins")
+def enrich_orders(df_ord, COST_MAP):
+    prod = pd.DataFrame.from_dict(COST_MAP, orient="index") if COST_MAP else pd.DataFrame(columns=list(DEFAULT_PRODUCT))
+    prod = prod.reindex(df_ord["parent_id"])
+    for k, v in DEFAULT_PRODUCT.items():
+        if k != "created_at": prod[k] = prod[k].where(prod[k].notna(), v) if k in prod else v
+    cost = prod["cost"].to_numpy(dtype=float); fiscal = prod["fiscal"].astype(str).str.upper().to_numpy()
+    commission = compute_commission(df_ord)
+    created = pd.to_datetime(prod["created_at"]) if "created_at" in prod else pd.Series(pd.NaT, index=prod.index)
+    rotation = pd.Series(df_ord["date"].to_numpy() - created.to_numpy()).dt.days.fillna(0).clip(lower=0).astype(int).to_numpy()
+    df_ord["cost"] = cost; df_ord["fiscal"] = fiscal; df_ord["margin_real"] = compute_margin(df_ord["total_ttc"], cost, fiscal, commission)
+    for k in ("brand", "cat", "subcat", "type"): df_ord[k] = prod[k].to_numpy()
+    df_ord["rotation"] = rotation; df_ord["commission"] = commission
+    pid = df_ord["parent_id"].astype(object); unresolved = (pid.notna() & (pid != "") & ~pid.isin(list(COST_MAP))).to_numpy()
+    if unresolved.any(): # producto que Shopify no devolvió: NULL (pendiente), nunca coste 0 con margen = precio entero. sync_orders lo reintenta pasado PRODUCT_FAILED_TTL.
+        df_ord["rotation"] = df_ord["rotation"].astype(float); df_ord.loc[unresolved, [c for c in ENRICH_COLS if c != "commission"]] = np.nan
+    cols_to_round = ["cost", "total_ttc", "margin_real", "discount", "commission"]
+    df_ord[cols_to_round] = df_ord[cols_to_round].round(0)
+    return df_ord
+
+def build_order_frame(raw_orders, shop_url, token, db_path=None):
+    # Pedidos REST (lista u OrderBuffer ya llenado) -> (df normalizado y enriquecido, ids de pedidos descartados, enriquecimiento completo)
+    # Completo = cada producto resuelto o apuntado como fallido: uno que no responde no bloquea la marca; sus pedidos quedan NULL hasta el reintento.
+    with metrics.span("orders.normalize", orders=len(raw_orders)):
+        buf = raw_orders if isinstance(raw_orders, OrderBuffer) else OrderBuffer().extend(raw_orders)
+        df_ord = buf.frame(); dropped_ids = buf.dropped
+    product_ids_to_fetch = [pid for pid in df_ord["parent_id"] if pid] if not df_ord.empty else []
+    enriched_ok = True
+    if not df_ord.empty and product_ids_to_fetch:
+        COST_MAP = fetch_product_details_batch(product_ids_to_fetch, shop_url, token, db_path=db_path)
+        missing = [pid for pid in dict.fromkeys(product_ids_to_fetch) if pid not in COST_MAP]
+        enriched_ok = not missing or product_cache.failed(missing, db_path) >= {str(pid) for pid in missing}
+        df_ord = enrich_orders(df_ord, COST_MAP)
+    return df_ord, dropped_ids, enriched_ok
+
+def order_window_start(start_date_limit): return pd.to_datetime(start_date_limit) - timedelta(days=2)
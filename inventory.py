@@ -0,0 +1,202 @@
+import re
+import json
+import itertools
+import numpy as np
+import pandas as pd
+import requests
+from datetime import datetime, timedelta, timezone
+from data_engine import graphql_url, cache_product_nodes, parse_specs, PRODUCT_FIELDS, SPEC_FIELDS
+import local_db
+import metrics
+from shopify_client import get_client
+
+# ==============================================================================
+# INVENTARIO (CONTROL PRECIOS): FOTO LOCAL + REFRESCO INCREMENTAL
+# ==============================================================================
+# Primera vez: recorrido completo de productos activos. Después sólo "updated_at:>marca":
+# los productos vendidos / archivados / en lista negra que llegan en el delta salen de la foto.
+BLACKLIST = ["taller", "gift card", "garantía", "garantia", "smartsense", "accesorio", "pack", "freight", "envío", "fianza", "caja", "embalaje"]
+INVENTORY_OVERLAP = timedelta(minutes=5)
+MIN_MARGIN_BUFFER = 50.0
+DISCOUNT_LADDER = [(45, 50.0), (75, 80.0), (90, 120.0), (120, 150.0), (150, 200.0)] # (días en stock >=, descuento objetivo €)
+BUFFER_FREE_DAYS = 365 # más antigua: se descuenta sin colchón de margen
+AGING_BUCKETS = [("CRITICO", 360), ("URGENTE", 180), ("ATENCION", 90), ("MONITORIZAR", 45)] # (tramo, días en stock >), de más a menos antigua
+INVENTORY_SCHEMA = {
+    "product_id": "TEXT PRIMARY KEY", "sku": "TEXT", "title": "TEXT", "img": "TEXT", "created_at": "TEXT", "updated_at": "TEXT",
+    "price_curr": "REAL", "price_init": "REAL", "cost": "REAL", "fiscal": "TEXT", "specs": "TEXT",
+}
+
+NODE_FIELDS = f"id status tags totalInventory featuredImage {{ url }} variants(first: 1) {{ edges {{ node {{ price compareAtPrice sku }} }} }} {PRODUCT_FIELDS} {SPEC_FIELDS}"
+NODE_BATCH = 25 # productos por consulta en fetch_product_nodes
+
+def connect(db_path=None):
+    con = local_db.connect(db_path)
+    con.execute(f"CREATE TABLE IF NOT EXISTS inventory ({', '.join(f'{c} {t}' for c, t in INVENTORY_SCHEMA.items())})")
+    con.execute("CREATE TABLE IF NOT EXISTS sync_state (key TEXT PRIMARY KEY, value TEXT)")
+    existing = {r[1] for r in con.execute("PRAGMA table_info(inventory)")}
+    for c, t in INVENTORY_SCHEMA.items():
+        if c not in existing: con.execute(f"ALTER TABLE inventory ADD COLUMN {c} {t}") # base creada por una versión anterior
+    return con
+
+def crawl_products(shop_url, token, query):
+    # -> (nodos, completo)
+    all_nodes = []; has_next = True; cursor = None
+    with metrics.span("inventory.crawl") as sp:
+        while has_next:
+            q_args = f'first: 250, query: "{query}", sortKey: CREATED_AT, reverse: false'
+            if cursor: q_args += f', after: "{cursor}"'
+            q = f"""{{ products({q_args}) {{ pageInfo {{ hasNextPage endCursor }} edges {{ node {{ {NODE_FIELDS} }} }} }} }}"""
+            try:
+                payload, r = get_client(token).graphql(graphql_url(shop_url), q)
+                sp["pages"] += 1; sp["bytes"] += len(r.content); sp["cost"] += metrics.gql_cost(payload); d = payload["data"]["products"]
+                all_nodes.extend(e["node"] for e in d.get("edges", [])); has_next = d.get("pageInfo", {}).get("hasNextPage", False); cursor = d.get("pageInfo", {}).get("endCursor")
+            except (requests.RequestException, ValueError, KeyError, TypeError): sp["errors"] += 1; return all_nodes, False
+        sp["products"] = len(all_nodes)
+    return all_nodes, True
+
+def node_to_row(node):
+    # Nodo producto -> fila de inventario (None si no cuenta como bici en stock)
+    title_lower = (node.get("title") or "").lower(); tags = (node.get("tags") or []); inv = node.get("totalInventory") or 0
+    if str(node.get("status", "ACTIVE")).upper() != "ACTIVE": return None
+    if inv < 1 or "bici_market" in tags or any(bad in title_lower for bad in BLACKLIST): return None
+    v_edges = (node.get("variants") or {}).get("edges") or []
+    if not v_edges: return None
+    v = v_edges[0]["node"]
+    try:
+        p_curr = float(v.get("price", 0.0))
+        comp_price = v.get("compareAtPrice")
+        p_init = float(comp_price) if comp_price else p_curr
+        sku = v.get("sku", "")
+    except (TypeError, ValueError): p_curr = 0.0; p_init = 0.0; sku = ""
+    raw_c_node = node.get("metafield")
+    raw_c = raw_c_node["value"] if raw_c_node else "0"
+    try: cost = float(re.sub(r'[^\d.]', '', str(raw_c).replace(',','.'))) if raw_c else 0.0
+    except ValueError: cost = 0.0
+    fiscal_node = node.get("fiscal")
+    return {"product_id": node["id"].rsplit("/", 1)[-1], "sku": sku, "title": node["title"], "img": node["featuredImage"]["url"] if node.get("featuredImage") else None,
+            "created_at": pd.to_datetime(node["createdAt"]).tz_convert(None).isoformat(), "updated_at": pd.to_datetime(node["updatedAt"]).tz_convert(None).isoformat(),
+            "price_curr": p_curr, "price_init": p_init, "cost": cost, "fiscal": fiscal_node["value"] if fiscal_node else "PRO", "specs": json.dumps(parse_specs(node))}
+
+def apply_nodes(con, nodes):
+    # Upsert de lo que sigue en stock, borrado de lo que ya no
+    keep = []; drop = []
+    for node in nodes:
+        row = node_to_row(node)
+        if row: keep.append(row)
+        else: drop.append((node["id"].rsplit("/", 1)[-1],))
+    cols = list(INVENTORY_SCHEMA)
+    con.executemany("DELETE FROM inventory WHERE product_id = ?", drop)
+    con.executemany(f"INSERT OR REPLACE INTO inventory ({', '.join(cols)}) VALUES ({', '.join('?' * len(cols))})", [tuple(r[c] for c in cols) for r in keep])
+
+@metrics.timed("inventory.refresh")
+def refresh_inventory(shop_url, token, db_path=None):
+    con = connect(db_path)
+    try:
+        row = con.execute("SELECT value FROM sync_state WHERE key = 'inventory_watermark'").fetchone(); started = datetime.now(timezone.utc)
+        if row: nodes, complete = crawl_products(shop_url, token, f"updated_at:>'{row[0]}'")
+        else: nodes, complete = crawl_products(shop_url, token, "status:active")
+        cache_product_nodes(nodes, db_path)
+        with con:
+            if not row and complete: con.execute("DELETE FROM inventory") # foto completa: sustituye a la anterior
+            apply_nodes(con, nodes)
+            if complete: con.execute("INSERT OR REPLACE INTO sync_state (key, value) VALUES ('inventory_watermark', ?)", ((started - INVENTORY_OVERLAP).strftime("%Y-%m-%dT%H:%M:%SZ"),))
+    finally: con.close()
+
+def fetch_product_nodes(shop_url, token, product_ids):
+    # -> {pid: nodo completo, o None si el producto ya no existe}. requests.RequestException / ValueError / KeyError si Shopify falla.
+    ids = [str(p) for p in dict.fromkeys(product_ids)]; out = {}
+    for i in range(0, len(ids), NODE_BATCH):
+        part = ids[i:i + NODE_BATCH]
+        q = "{ " + " ".join(f'p{j}: product(id: "gid://shopify/Product/{pid}") {{ {NODE_FIELDS} }}' for j, pid in enumerate(part)) + " }"
+        payload, _ = get_client(token).graphql(graphql_url(shop_url), q); data = payload["data"]
+        out.update({pid: data.get(f"p{j}") for j, pid in enumerate(part)})
+    return out
+
+@metrics.timed("inventory.update")
+def update_products(product_ids, shop_url, token, db_path=None):
+    # Webhook products/update: sólo esos productos -> caché de producto + foto de inventario (sin tocar la marca del delta)
+    nodes = fetch_product_nodes(shop_url, token, product_ids); alive = [n for n in nodes.values() if n]
+    cache_product_nodes(alive, db_path); con = connect(db_path)
+    try:
+        with con:
+            apply_nodes(con, alive)
+            con.executemany("DELETE FROM inventory WHERE product_id = ?", [(pid,) for pid, n in nodes.items() if n is None])
+    finally: con.close()
+    return nodes
+
+@metrics.timed("inventory.load")
+def load_inventory(db_path=None, now=None):
+    # Misma forma que el antiguo get_current_stock_and_pricing: sku, title, img, days, price_curr, price_init, cost, fiscal, margin_curr, updated_at
+    con = connect(db_path)
+    try: df = pd.read_sql_query("SELECT * FROM inventory ORDER BY created_at ASC", con)
+    finally: con.close()
+    if df.empty: return pd.DataFrame()
+    now = now or datetime.now()
+    df["days"] = (pd.Timestamp(now) - pd.to_datetime(df["created_at"])).dt.days; df["updated_at"] = pd.to_datetime(df["updated_at"])
+    p = df["price_curr"].to_numpy(); c = df["cost"].to_numpy(); f = df["fiscal"].astype(str).str.upper()
+    m = np.where(f.str.contains("REBU", regex=False), (p - c) / 1.21, np.where(f.str.contains("INTRA", regex=False), p - c, (p / 1.21) - (c / 1.21)))
+    df["margin_curr"] = np.where((c > 0) & (p > 0), m, 0.0)
+    return df[["sku", "title", "img", "days", "price_curr", "price_init", "cost", "fiscal", "margin_curr", "updated_at"]]
+
+def data_as_of(db_path=None):
+    con = connect(db_path)
+    try: row = con.execute("SELECT value FROM sync_state WHERE key = 'inventory_watermark'").fetchone()
+    finally: con.close()
+    return pd.Timestamp(row[0]) + INVENTORY_OVERLAP if row else None
+
+def get_current_stock_and_pricing(shop_url, token, db_path=None):
+    refresh_inventory(shop_url, token, db_path)
+    return load_inventory(db_path)
+
+# --- PRECIOS RECOMENDADOS (VECTORIZADO) ---
+def discount_matrix(days, margin, ladders, buffers):
+    # -> descuento (S x N) para S políticas (escalón, colchón) y N bicis. Escalones de distinta longitud: se rellenan con umbral infinito.
+    days = np.asarray(days, dtype=float)[None, :]; margin = np.asarray(margin, dtype=float)[None, :]
+    k = max((len(l) for l in ladders), default=0); thr = np.full((len(ladders), k), np.inf); amt = np.zeros((len(ladders), k))
+    for i, l in enumerate(ladders):
+        if l: thr[i, :len(l)], amt[i, :len(l)] = zip(*l)
+    target = np.zeros((len(ladders), days.shape[1]))
+    for j in range(k): target = np.where(days >= thr[:, j:j + 1], amt[:, j:j + 1], target) # gana el último escalón que se cumple, como en calculate_smart_discount
+    capacity = margin - np.where(days > BUFFER_FREE_DAYS, 0.0, np.asarray(buffers, dtype=float)[:, None])
+    return np.round(np.minimum(target, np.maximum(0, capacity)) / 10) * 10
+
+def smart_discount(days, margin, is_deposit=None, ladder=DISCOUNT_LADDER, buffer=MIN_MARGIN_BUFFER):
+    # Igual que calculate_smart_discount, para columnas enteras
+    disc = discount_matrix(days, margin, [ladder], [buffer])[0]
+    return np.where(is_deposit, 0.0, disc) if is_deposit is not None else disc
+
+def add_pricing_columns(df_stock):
+    df_stock = df_stock.copy()
+    df_stock["disc"] = smart_discount(df_stock["days"], df_stock["margin_curr"]); df_stock["rec"] = df_stock["price_curr"] - df_stock["disc"]
+    rebu = df_stock["fiscal"].astype(str).str.contains("REBU", regex=False).to_numpy()
+    df_stock["m_proj"] = np.where(rebu, (df_stock["rec"] - df_stock["cost"]) / 1.21, (df_stock["rec"] / 1.21) - (df_stock["cost"] / 1.21))
+    return df_stock
+
+# --- ESCENARIOS DE PRECIO (WHAT-IF) ---
+# Cientos de políticas de descuento sobre la foto de inventario de una vez (discount_matrix): sin tocar código ni volver a pedir el catálogo.
+def aging_bucket(days):
+    # -> índice en AGING_BUCKETS por bici (len(AGING_BUCKETS) = menos de 45 días, fuera de las tablas)
+    days = np.asarray(days); out = np.full(days.shape, len(AGING_BUCKETS))
+    for i, (_, lo) in reversed(list(enumerate(AGING_BUCKETS))): out = np.where(days > lo, i, out)
+    return out
+
+def scenario_grid(ladder=DISCOUNT_LADDER, scales=(1.0,), shifts=(0,), buffers=(MIN_MARGIN_BUFFER,)):
+    # Variantes de un escalón: importes x escala, umbrales + días, cada colchón -> [{"name", "ladder", "buffer"}]
+    return [{"name": f"x{sc:.2f} {sh:+d}d {bf:.0f}€", "ladder": [(d + sh, a * sc) for d, a in ladder], "buffer": float(bf)} for sc, sh, bf in itertools.product(scales, shifts, buffers)]
+
+@metrics.timed("pricing.scenarios")
+def evaluate_scenarios(df_stock, scenarios):
+    # -> frame largo escenario x tramo: bicis, bicis con descuento, gasto en descuento y margen proyectado (mismo cálculo que m_proj)
+    disc = discount_matrix(df_stock["days"], df_stock["margin_curr"], [s["ladder"] for s in scenarios], [s["buffer"] for s in scenarios])
+    price = df_stock["price_curr"].to_numpy(dtype=float); cost = df_stock["cost"].to_numpy(dtype=float)
+    onehot = (aging_bucket(df_stock["days"].to_numpy())[:, None] == np.arange(len(AGING_BUCKETS))[None, :]).astype(float) # N x tramos
+    n_s = len(scenarios); n_b = len(AGING_BUCKETS)
+    return pd.DataFrame({"scenario": np.repeat([s["name"] for s in scenarios], n_b), "bucket": np.tile([b for b, _ in AGING_BUCKETS], n_s),
+                         "bikes": np.tile(onehot.sum(axis=0), n_s).astype(int), "discounted": ((disc > 0) @ onehot).ravel().astype(int),
+                         "spend": (disc @ onehot).ravel(), "margin": (((price - cost)[None, :] - disc) / 1.21 @ onehot).ravel()})
+
+def scenario_summary(res, baseline):
+    # -> una fila por escenario (totales de los cuatro tramos) con la diferencia frente a `baseline`, en el orden de entrada
+    tot = res.groupby("scenario", sort=False)[["discounted", "spend", "margin"]].sum()
+    tot["d_margin"] = tot["margin"] - tot.loc[baseline, "margin"]; tot["d_spend"] = tot["spend"] - tot.loc[baseline, "spend"]
+    return tot.reset_index()
@@ -0,0 +1,102 @@
+import os
+import threading
+import numpy as np
+import pandas as pd
+import local_db
+import metrics
+from inventory import AGING_BUCKETS, aging_bucket
+try: import pyarrow as pa; import pyarrow.parquet as pq
+except ImportError: pa = pq = None # sin pyarrow: no se guarda histórico (Control Precios sólo muestra el presente)
+
+# ==============================================================================
+# HISTÓRICO DIARIO DEL INVENTARIO (ANTIGÜEDAD DEL STOCK EN EL TIEMPO)
+# ==============================================================================
+# Tras cada recorrido de inventario se apunta la foto (misma forma que load_inventory) en HISTORY_DIR/day=AAAA-MM-DD/part.parquet:
+# - Sólo las filas que cambian respecto al último estado conocido de cada SKU (precio, coste, fiscal, margen), más una baja
+#   (removed) cuando el SKU sale del stock. Un SKU tocado varias veces el mismo día: sólo su último valor.
+# - `days` es la antigüedad el día del cambio; la de cualquier otro día sale sumando los días transcurridos.
+# Las tendencias se calculan sobre estos ficheros, sin llamar a Shopify.
+HISTORY_COLS = ["sku", "days", "price_curr", "price_init", "cost", "fiscal", "margin_curr"]
+VALUE_COLS = ["price_curr", "price_init", "cost", "fiscal", "margin_curr"]
+_STATE = {} # carpeta -> (último fichero, mtime, estado por SKU): evita releer todo el histórico en cada recorrido
+_LOCK = threading.RLock() # _STATE y el fichero del día se leen y reescriben juntos: sesiones y refresco de fondo comparten el proceso
+
+def history_dir(hist_dir=None, db_path=None): return hist_dir or os.environ.get("TUVALUM_HISTORY_DIR") or os.path.join(os.path.dirname(db_path or local_db.DB_PATH), "inventory_history")
+
+def _schema():
+    return pa.schema([("day", pa.date32()), ("sku", pa.string()), ("days", pa.int32()), ("price_curr", pa.float64()), ("price_init", pa.float64()), ("cost", pa.float64()),
+                      ("fiscal", pa.dictionary(pa.int8(), pa.string())), ("margin_curr", pa.float64()), ("removed", pa.bool_())])
+
+def _day_files(hist_dir, end=None):
+    # -> [(día, ruta)] ordenados; end acota por nombre de carpeta sin abrir ficheros
+    if not os.path.isdir(hist_dir): return []
+    days = sorted(d[4:] for d in os.listdir(hist_dir) if d.startswith("day=") and os.path.exists(os.path.join(hist_dir, d, "part.parquet")))
+    if end is not None: days = [d for d in days if d <= f"{pd.Timestamp(end):%Y-%m-%d}"]
+    return [(d, os.path.join(hist_dir, f"day={d}", "part.parquet")) for d in days]
+
+def read_history(end=None, hist_dir=None):
+    # -> filas de cambio hasta `end` (incluido), por día y SKU
+    files = _day_files(history_dir(hist_dir), end)
+    if pq is None or not files: return pd.DataFrame(columns=["day", *HISTORY_COLS, "removed"])
+    df = pa.concat_tables([pq.read_table(p, schema=_schema()) for _, p in files]).to_pandas()
+    df["day"] = pd.to_datetime(df["day"]); df["fiscal"] = df["fiscal"].astype(object)
+    return df.sort_values(["day", "sku"], kind="stable").reset_index(drop=True)
+
+def last_state(hist_dir=None):
+    # -> última fila de cada SKU (bajas incluidas), indexada por SKU
+    hist_dir = history_dir(hist_dir)
+    with _LOCK:
+        files = _day_files(hist_dir); tag = (files[-1][0], os.stat(files[-1][1]).st_mtime_ns) if files else None
+        cached = _STATE.get(hist_dir)
+        if cached and cached[0] == tag: return cached[1]
+        state = read_history(hist_dir=hist_dir).drop_duplicates("sku", keep="last").set_index("sku")
+        _STATE[hist_dir] = (tag, state)
+        return state
+
+@metrics.timed("inventory.history")
+def record(df_stock, now=None, hist_dir=None):
+    # Foto actual (load_inventory) -> filas cambiadas añadidas a la partición del día. Devuelve cuántas se escriben.
+    if pq is None or df_stock is None: return 0
+    hist_dir = history_dir(hist_dir); day = pd.Timestamp(now if now is not None else pd.Timestamp.now()).normalize()
+    with _LOCK:
+        cur = df_stock[HISTORY_COLS].drop_duplicates("sku", keep="last").set_index("sku") if not df_stock.empty else pd.DataFrame(columns=HISTORY_COLS).set_index("sku")
+        prev = last_state(hist_dir); alive = prev[~prev["removed"]] if not prev.empty else prev
+        old = alive.reindex(cur.index)
+        changed = old["price_curr"].isna() | (old[VALUE_COLS].astype(object).ne(cur[VALUE_COLS].astype(object))).any(axis=1) # SKU nuevo o que vuelve, o cualquier valor distinto
+        new = cur[changed.to_numpy()].assign(removed=False)
+        gone = alive.index.difference(cur.index)
+        rows = pd.concat([d for d in (new.reset_index(), pd.DataFrame({"sku": gone, "removed": True})) if not d.empty], ignore_index=True) if len(new) or len(gone) else pd.DataFrame()
+        if rows.empty: return 0
+        path = os.path.join(hist_dir, f"day={day:%Y-%m-%d}", "part.parquet"); os.makedirs(os.path.dirname(path), exist_ok=True)
+        rows = rows.assign(day=day.date()).reindex(columns=["day", *HISTORY_COLS, "removed"])
+        if os.path.exists(path): rows = pd.concat([pq.read_table(path, schema=_schema()).to_pandas().assign(fiscal=lambda d: d["fiscal"].astype(object)), rows], ignore_index=True).drop_duplicates("sku", keep="last")
+        rows["days"] = rows["days"].astype("Int32")
+        pq.write_table(pa.Table.from_pandas(rows, schema=_schema(), preserve_index=False), path + ".tmp"); os.replace(path + ".tmp", path)
+        upd = rows.assign(day=pd.to_datetime(rows["day"])).set_index("sku") # estado en memoria al día sin releer el histórico
+        _STATE[hist_dir] = ((f"{day:%Y-%m-%d}", os.stat(path).st_mtime_ns), pd.concat([d for d in (prev.drop(upd.index, errors="ignore"), upd) if not d.empty]))
+        return len(rows)
+
+def stock_as_of(day, hist_dir=None):
+    # -> foto del inventario tal como estaba al final de `day` (misma forma que HISTORY_COLS, days recalculado a ese día)
+    day = pd.Timestamp(day).normalize(); h = read_history(day, hist_dir).drop_duplicates("sku", keep="last")
+    h = h[~h["removed"]]
+    return h.assign(days=h["days"].astype(int) + (day - h["day"]).dt.days.to_numpy())[HISTORY_COLS].reset_index(drop=True)
+
+@metrics.timed("inventory.trend")
+def aging_trend(start, end, hist_dir=None):
+    # -> una fila por día y tramo de AGING_BUCKETS: bicis, valor a precio actual y margen. Vectorizado: cada fila de cambio vale
+    # desde su día hasta el siguiente cambio del mismo SKU, y se reparte sobre los días pedidos que caen en ese intervalo.
+    grid = pd.date_range(pd.Timestamp(start).normalize(), pd.Timestamp(end).normalize(), freq="D")
+    h = read_history(grid[-1] if len(grid) else None, hist_dir)
+    cols = ["day", "bucket", "bikes", "value", "margin"]
+    if h.empty or not len(grid): return pd.DataFrame(columns=cols)
+    h = h.sort_values(["sku", "day"], kind="stable")
+    nxt = h.groupby("sku")["day"].shift(-1).fillna(grid[-1] + pd.Timedelta(days=1))
+    live = ~h["removed"].to_numpy(); g = grid.to_numpy()
+    lo = np.searchsorted(g, h["day"].to_numpy()[live]); hi = np.searchsorted(g, nxt.to_numpy()[live]); n = hi - lo
+    row = np.repeat(np.arange(live.sum()), n); q = np.repeat(lo - np.cumsum(np.r_[0, n[:-1]]), n) + np.arange(n.sum()) # índice de día pedido por repetición
+    hl = h[live]; age = hl["days"].to_numpy(dtype=float)[row] + (g[q] - hl["day"].to_numpy()[row]) / np.timedelta64(1, "D")
+    b = aging_bucket(age); keep = b < len(AGING_BUCKETS)
+    out = pd.DataFrame({"day": g[q][keep], "bucket": np.array([k for k, _ in AGING_BUCKETS])[b[keep]], "bikes": 1,
+                        "value": hl["price_curr"].to_numpy()[row][keep], "margin": hl["margin_curr"].to_numpy()[row][keep]})
+    return out.groupby(["day", "bucket"], as_index=False, sort=True)[["bikes", "value", "margin"]].sum()[cols]
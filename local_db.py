@@ -0,0 +1,15 @@
+import os
+import sqlite3
+
+# ==============================================================================
+# BASE LOCAL (SQLITE) COMPARTIDA: PEDIDOS, PRODUCTOS, ESTADO DE SINCRONIZACIÓN
+# ==============================================================================
+DATA_DIR = os.environ.get("TUVALUM_DATA_DIR", ".data")
+DB_PATH = os.path.join(DATA_DIR, "tuvalum.db")
+
+def connect(db_path=None):
+    db_path = db_path or DB_PATH
+    os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+    con = sqlite3.connect(db_path, timeout=30)
+    con.execute("PRAGMA journal_mode=WAL")
+    return con
@@ -0,0 +1,102 @@
+import json
+import time
+import functools
+import threading
+import numpy as np
+from collections import deque, defaultdict
+
+# ==============================================================================
+# MÉTRICAS: SPANS POR ETAPA (DURACIÓN + PÁGINAS / BYTES / COSTE GRAPHQL)
+# ==============================================================================
+# with metrics.span("orders.fetch") as sp: ...; sp["pages"] += 1; sp["bytes"] += len(r.content)
+# - Atributos numéricos: se acumulan como contadores por etapa. "label" separa series (p.ej. una página de la app).
+# - Últimos SPAN_BUFFER spans en memoria para percentiles (panel debug); histograma acumulado para Prometheus.
+# Un registro por proceso: lo comparten todas las sesiones y el hilo de refresco.
+SPAN_BUFFER = 5000
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+def _esc(v): return str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+class Span(dict):
+    def __init__(self, registry, name, label="", **attrs):
+        super().__init__(attrs); self.registry = registry; self.name = name; self.label = label; self.t0 = None; self.started = None
+
+    def __missing__(self, k): return 0 # sp["pages"] += 1 sin inicializar
+
+    def start(self): self.t0 = time.perf_counter(); self.started = time.time(); return self
+
+    def end(self):
+        if self.t0 is None: return
+        self.registry.record(self.name, time.perf_counter() - self.t0, label=self.label, started=self.started, **self); self.t0 = None
+
+    def __enter__(self): return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None: self["errors"] += 1
+        self.end()
+
+class Registry:
+    def __init__(self, buffer=SPAN_BUFFER):
+        self.lock = threading.Lock(); self.spans = deque(maxlen=buffer)
+        self.hist = defaultdict(lambda: [0] * (len(BUCKETS) + 1)); self.sums = defaultdict(float); self.counts = defaultdict(int); self.totals = defaultdict(float)
+
+    def span(self, name, label="", **attrs): return Span(self, name, label, **attrs)
+
+    def record(self, name, seconds, label="", started=None, **attrs):
+        key = (name, label); rec = {"name": name, "label": label, "started": started or time.time() - seconds, "seconds": round(seconds, 6), **attrs}
+        with self.lock:
+            self.spans.append(rec); self.sums[key] += seconds; self.counts[key] += 1
+            self.hist[key][next((i for i, b in enumerate(BUCKETS) if seconds <= b), len(BUCKETS))] += 1
+            for k, v in attrs.items():
+                if isinstance(v, (int, float)) and not isinstance(v, bool): self.totals[key + (k,)] += v
+
+    def recent(self, n=None):
+        with self.lock: spans = list(self.spans)
+        return spans[-n:] if n else spans
+
+    def summary(self):
+        # Por etapa (y label): nº, total, media, p50, p95, máx sobre los spans en memoria + contadores acumulados
+        groups = defaultdict(list)
+        for s in self.recent(): groups[(s["name"], s["label"])].append(s["seconds"])
+        with self.lock: totals = dict(self.totals)
+        rows = []
+        for (name, label), secs in sorted(groups.items()):
+            a = np.asarray(secs); row = {"stage": name, "label": label, "n": len(a), "total_s": round(float(a.sum()), 3), "mean_s": round(float(a.mean()), 4),
+                                         "p50_s": round(float(np.percentile(a, 50)), 4), "p95_s": round(float(np.percentile(a, 95)), 4), "max_s": round(float(a.max()), 4)}
+            row.update({k[2]: v for k, v in totals.items() if k[:2] == (name, label)}); rows.append(row)
+        return rows
+
+    def to_json(self): return json.dumps({"summary": self.summary(), "spans": self.recent()}, default=str)
+
+    def to_prometheus(self, prefix="tuvalum"):
+        def lbl(key, **extra):
+            d = {"stage": key[0], "label": key[1], **extra}
+            return "{" + ",".join(f'{k}="{_esc(v)}"' for k, v in d.items()) + "}"
+        with self.lock: hist = {k: list(v) for k, v in self.hist.items()}; sums = dict(self.sums); counts = dict(self.counts); totals = dict(self.totals)
+        out = [f"# HELP {prefix}_stage_seconds Duración de cada etapa", f"# TYPE {prefix}_stage_seconds histogram"]
+        for key in sorted(hist):
+            cum = 0
+            for b, c in zip(BUCKETS, hist[key]): cum += c; out.append(f"{prefix}_stage_seconds_bucket{lbl(key, le=b)} {cum}")
+            out.append(f"{prefix}_stage_seconds_bucket{lbl(key, le='+Inf')} {counts[key]}")
+            out.append(f"{prefix}_stage_seconds_sum{lbl(key)} {sums[key]:.6f}"); out.append(f"{prefix}_stage_seconds_count{lbl(key)} {counts[key]}")
+        out += [f"# HELP {prefix}_stage_attr_total Páginas, bytes, coste GraphQL... acumulados por etapa", f"# TYPE {prefix}_stage_attr_total counter"]
+        for key in sorted(totals): out.append(f"{prefix}_stage_attr_total{lbl(key[:2], attr=key[2])} {totals[key]:g}")
+        return "\n".join(out) + "\n"
+
+    def reset(self):
+        with self.lock: self.spans.clear(); self.hist.clear(); self.sums.clear(); self.counts.clear(); self.totals.clear()
+
+def gql_cost(payload): return (((payload or {}).get("extensions") or {}).get("cost") or {}).get("actualQueryCost") or 0
+
+REGISTRY = Registry()
+span = REGISTRY.span
+record = REGISTRY.record
+
+def timed(name):
+    # Decorador: toda la llamada como un span
+    def deco(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kw):
+            with span(name): return fn(*args, **kw)
+        return wrapper
+    return deco
@@ -0,0 +1,203 @@
+import pandas as pd
+from datetime import datetime, timedelta, timezone
+from data_engine import fetch_orders, fetch_orders_sharded, order_shards, OrderBuffer, build_order_frame, enrich_orders, fetch_product_details_batch, ENRICH_COLS
+from bulk_orders import load_orders_bulk, BulkOperationError
+import local_db
+import product_cache
+import rollups
+import metrics
+import logging
+import requests
+
+# ==============================================================================
+# ALMACÉN LOCAL DE PEDIDOS (SQLITE) + SINCRONIZACIÓN INCREMENTAL
+# ==============================================================================
+SYNC_OVERLAP = timedelta(minutes=5) # marge pour les horloges décalées / commits tardifs côté Shopify
+log = logging.getLogger(__name__)
+
+ORDER_SCHEMA = {
+    "order_id": "INTEGER PRIMARY KEY", "updated_at": "TEXT", "date": "TEXT", "total_ttc": "REAL",
+    "status": "TEXT", "channel": "TEXT", "mp_name": "TEXT", "clean_mp": "TEXT", "order_name": "TEXT", "parent_id": "TEXT",
+    "country": "TEXT", "sku": "TEXT", "discount": "REAL", "currency_code": "TEXT", "raw_price_val": "REAL",
+    "cost": "REAL", "fiscal": "TEXT", "margin_real": "REAL", "brand": "TEXT", "cat": "TEXT", "subcat": "TEXT",
+    "type": "TEXT", "rotation": "INTEGER", "commission": "REAL",
+}
+ORDER_COLUMNS = list(ORDER_SCHEMA.keys())
+# Frames de la app: texto repetitivo como categorías, importes ya redondeados en float32 (total_ttc / raw_price_val siguen en float64)
+CATEGORY_COLS = ["status", "channel", "mp_name", "clean_mp", "country", "currency_code", "fiscal", "brand", "cat", "subcat", "type"]
+FLOAT32_COLS = ["cost", "discount", "commission", "margin_real"]
+
+def connect(db_path=None):
+    con = local_db.connect(db_path)
+    cols = ", ".join(f"{c} {t}" for c, t in ORDER_SCHEMA.items())
+    con.execute(f"CREATE TABLE IF NOT EXISTS orders ({cols})")
+    con.execute("CREATE INDEX IF NOT EXISTS idx_orders_date ON orders(date)")
+    con.execute("CREATE INDEX IF NOT EXISTS idx_orders_pending ON orders(parent_id) WHERE margin_real IS NULL") # producto sin resolver (retry_unresolved)
+    con.execute("CREATE TABLE IF NOT EXISTS sync_state (key TEXT PRIMARY KEY, value TEXT)")
+    rollups.ensure_table(con)
+    return con
+
+def get_state(con, key):
+    row = con.execute("SELECT value FROM sync_state WHERE key = ?", (key,)).fetchone()
+    return pd.Timestamp(row[0]) if row else None
+
+def set_state(con, key, value): con.execute("INSERT OR REPLACE INTO sync_state (key, value) VALUES (?, ?)", (key, pd.Timestamp(value).isoformat()))
+
+def _db_value(v):
+    if isinstance(v, pd.Timestamp): return v.isoformat()
+    if v is None or (isinstance(v, float) and pd.isna(v)): return None
+    return v.item() if hasattr(v, "item") else v
+
+@metrics.timed("orders.store")
+def upsert_orders(con, df_ord, dropped_ids=()):
+    # Escribe pedidos y recalcula en el cubo sólo los días tocados (antes y después del cambio)
+    has_rows = df_ord is not None and not df_ord.empty
+    days = rollups.touched_days(con, list(dropped_ids) + (df_ord["order_id"].tolist() if has_rows else []))
+    if dropped_ids: con.executemany("DELETE FROM orders WHERE order_id = ?", [(int(i),) for i in dropped_ids])
+    n = 0
+    if has_rows:
+        cols = [c for c in ORDER_COLUMNS if c in df_ord.columns]
+        rows = [tuple(_db_value(v) for v in rec) for rec in df_ord[cols].itertuples(index=False, name=None)]
+        con.executemany(f"INSERT OR REPLACE INTO orders ({', '.join(cols)}) VALUES ({', '.join('?' * len(cols))})", rows)
+        days.update(pd.to_datetime(df_ord["date"]).dt.strftime("%Y-%m-%d")); n = len(rows)
+    rollups.refresh_days(con, days)
+    return n
+
+def newer_only(con, df_ord):
+    # Webhooks: un orders/updated que llega tarde (o reenviado) no pisa una versión más reciente ya guardada
+    if df_ord is None or df_ord.empty: return df_ord
+    ids = [int(i) for i in df_ord["order_id"]]; stored = {}
+    for i in range(0, len(ids), 500):
+        part = ids[i:i + 500]
+        stored.update(con.execute(f"SELECT order_id, updated_at FROM orders WHERE order_id IN ({','.join('?' * len(part))})", part).fetchall())
+    prev = pd.to_datetime(df_ord["order_id"].map(stored), utc=True, format="ISO8601")
+    return df_ord[prev.isna() | (pd.to_datetime(df_ord["updated_at"], utc=True, format="ISO8601") >= prev)]
+
+@metrics.timed("orders.reprice")
+def reprice_orders(product_ids, db_path=None):
+    # Producto modificado (coste, fiscal...) -> margen de sus pedidos recalculado con la caché de producto, sin llamar a Shopify
+    ids = [str(p) for p in dict.fromkeys(product_ids)]
+    fresh, stale = product_cache.lookup(ids, db_path); cost_map = {**{pid: d for pid, (d, _) in stale.items()}, **fresh}
+    if not cost_map: return 0
+    con = connect(db_path)
+    try:
+        df = pd.read_sql_query(f"SELECT {', '.join(ORDER_COLUMNS)} FROM orders WHERE parent_id IN ({','.join('?' * len(cost_map))})", con, params=list(cost_map))
+        if df.empty: return 0
+        df["date"] = pd.to_datetime(df["date"])
+        with con: return upsert_orders(con, enrich_orders(df, cost_map))
+    finally: con.close()
+
+@metrics.timed("orders.retry_unresolved")
+def retry_unresolved(con, shop_url, token, db_path=None):
+    # Pedidos con producto sin resolver (margen NULL): se vuelve a pedir el producto una vez caducado su fallo y se recalculan sus pedidos.
+    # Así los tramos ya cerrados y el rango anterior a la marca se completan sin repetir el backfill.
+    pids = [pid for (pid,) in con.execute("SELECT DISTINCT parent_id FROM orders WHERE margin_real IS NULL AND parent_id IS NOT NULL AND parent_id != ''")]
+    if not pids: return 0
+    resolved = list(fetch_product_details_batch(pids, shop_url, token, db_path=db_path))
+    return reprice_orders(resolved, db_path) if resolved else 0
+
+def compact_frame(df):
+    for c in CATEGORY_COLS:
+        if c in df: df[c] = df[c].astype("category")
+    for c in FLOAT32_COLS:
+        if c in df: df[c] = df[c].astype("float32")
+    if "rotation" in df: df["rotation"] = pd.to_numeric(df["rotation"], downcast="integer")
+    return df
+
+def read_orders(con, start=None, end=None):
+    q = f"SELECT {', '.join(ORDER_COLUMNS)} FROM orders"; args = []; where = []
+    if start is not None: where.append("date >= ?"); args.append(pd.Timestamp(start).isoformat())
+    if end is not None: where.append("date <= ?"); args.append(pd.Timestamp(end).isoformat())
+    if where: q += " WHERE " + " AND ".join(where)
+    df = pd.read_sql_query(q + " ORDER BY date DESC", con, params=args)
+    if df.empty: return pd.DataFrame()
+    df["date"] = pd.to_datetime(df["date"])
+    if df[ENRICH_COLS].isna().all().all(): df = df.drop(columns=ENRICH_COLS) # jamais enrichi: même forme que l'ancien get_data_v100
+    return compact_frame(df)
+
+def shard_key(lo, hi): return f"shard:{pd.Timestamp(lo).isoformat()}/{pd.Timestamp(hi).isoformat()}"
+
+def backfill_orders(con, start, end, shop_url, token, now=None, db_path=None):
+    # Rango largo (p.ej. un año entero para Evolución) -> tramos mensuales en paralelo; los tramos cerrados ya descargados enteros no se repiten.
+    # Tramos que fallan por REST -> una Bulk Operation sobre el hueco. Devuelve (df, descartados, completo, tramos cerrados a marcar).
+    now = pd.Timestamp(now if now is not None else datetime.now(timezone.utc)).tz_localize(None)
+    done = {k for (k,) in con.execute("SELECT key FROM sync_state WHERE key LIKE 'shard:%'")}
+    pending = [s for s in order_shards(start, end) if s[1] is None or shard_key(*s) not in done]
+    buf = OrderBuffer(); results = fetch_orders_sharded(shop_url, token, pending, sink=buf)
+    failed = [s for s in pending if not results[s][1]]
+    df_new, dropped, enriched_ok = build_order_frame(buf, shop_url, token, db_path)
+    if failed:
+        lo = min(s[0] for s in failed); hi = None if any(s[1] is None for s in failed) else max(s[1] for s in failed)
+        try:
+            df_bulk, dropped_bulk = load_orders_bulk(shop_url, token, lo, hi, db_path=db_path)
+            df_new = pd.concat([d for d in (df_new, df_bulk) if not d.empty], ignore_index=True) if not df_bulk.empty else df_new; dropped = list(dropped) + list(dropped_bulk); failed = []
+        except (BulkOperationError, requests.RequestException, ValueError, KeyError) as e: log.warning("Tramos %s sin completar (Bulk KO: %s)", [shard_key(*s) for s in failed], e)
+    closed = [s for s in pending if s not in failed and s[1] is not None and pd.Timestamp(s[1]).tz_localize(None) <= now] if enriched_ok else []
+    return df_new, dropped, not failed and enriched_ok, closed
+
+@metrics.timed("orders.sync")
+def sync_orders(start, shop_url, token, db_path=None):
+    # 1) Rellena hacia atrás si se pide un periodo anterior a lo ya almacenado (tramos mensuales created_at_min/max en paralelo)
+    # 2) Delta de todo lo modificado desde la última marca (updated_at_min)
+    # 3) Reintento de los productos sin resolver cuyo fallo ya caducó (retry_unresolved)
+    # La marca sólo avanza si la paginación terminó entera y cada producto se enriqueció o quedó apuntado como fallido: un corte nunca
+    # deja huecos silenciosos, y un producto que no responde no obliga a repetir el backfill en cada ciclo (sus pedidos quedan NULL hasta el paso 3).
+    start = pd.Timestamp(start); con = connect(db_path)
+    try:
+        coverage = get_state(con, "coverage_start"); watermark = get_state(con, "watermark")
+        sync_started = datetime.now(timezone.utc)
+        if coverage is None or start < coverage:
+            df_new, dropped, complete, closed = backfill_orders(con, start, coverage, shop_url, token, db_path=db_path)
+            with con:
+                upsert_orders(con, df_new, dropped)
+                for s in closed: con.execute("INSERT OR REPLACE INTO sync_state (key, value) VALUES (?, ?)", (shard_key(*s), sync_started.isoformat()))
+            if complete:
+                with con:
+                    set_state(con, "coverage_start", start)
+                    if watermark is None: set_state(con, "watermark", sync_started - SYNC_OVERLAP)
+        if watermark is not None:
+            buf, complete = fetch_orders(shop_url, token, updated_at_min=watermark, sink=OrderBuffer())
+            df_new, dropped, enriched_ok = build_order_frame(buf, shop_url, token, db_path)
+            with con:
+                upsert_orders(con, df_new, dropped)
+                if complete and enriched_ok: set_state(con, "watermark", sync_started - SYNC_OVERLAP)
+        retry_unresolved(con, shop_url, token, db_path)
+    finally: con.close()
+
+def _read_state(key, db_path=None):
+    con = connect(db_path)
+    try: return get_state(con, key)
+    finally: con.close()
+
+def coverage_start(db_path=None): return _read_state("coverage_start", db_path)
+
+def data_as_of(db_path=None):
+    # Hora de la última sincronización completa (la marca guarda el inicio menos el solape)
+    wm = _read_state("watermark", db_path)
+    return wm + SYNC_OVERLAP if wm is not None else None
+
+def iter_orders(start=None, end=None, status=None, columns=None, chunksize=20000, db_path=None):
+    # Periodo en trozos de `chunksize` filas (más recientes primero), sin compactar: para exportar sin cargarlo entero
+    cols = columns or ORDER_COLUMNS; args = []; where = []
+    if start is not None: where.append("date >= ?"); args.append(pd.Timestamp(start).isoformat())
+    if end is not None: where.append("date <= ?"); args.append(pd.Timestamp(end).isoformat())
+    if status is not None: where.append("status = ?"); args.append(status)
+    q = f"SELECT {', '.join(cols)} FROM orders" + (" WHERE " + " AND ".join(where) if where else "") + " ORDER BY date DESC"
+    con = connect(db_path)
+    try:
+        for chunk in pd.read_sql_query(q, con, params=args, chunksize=chunksize):
+            if "date" in chunk: chunk["date"] = pd.to_datetime(chunk["date"])
+            yield chunk
+    finally: con.close()
+
+@metrics.timed("rollup.load")
+def load_rollup(start=None, end=None, db_path=None):
+    con = connect(db_path)
+    try: return rollups.read_rollup(con, start, end)
+    finally: con.close()
+
+@metrics.timed("orders.load")
+def load_orders(start, end=None, db_path=None):
+    con = connect(db_path)
+    try: return read_orders(con, start, end)
+    finally: con.close()
@@ -0,0 +1,116 @@
+import os
+import json
+import time
+import pandas as pd
+import local_db
+
+# ==============================================================================
+# CACHÉ PERSISTENTE DE METADATOS DE PRODUCTO (ID + UPDATEDAT)
+# ==============================================================================
+# Compartida por el enriquecimiento de pedidos, el inventario de Control Precios y la búsqueda por SKU.
+# - Dentro del TTL: se sirve tal cual, sin llamada a Shopify.
+# - Fuera del TTL: se revalida con una consulta ligera de updatedAt; sólo se vuelve a pedir lo que cambió.
+# - Tamaño acotado: se expulsan las entradas menos usadas (LRU) por encima de PRODUCT_CACHE_MAX.
+# - Producto que Shopify no devolvió tras los reintentos: fila sin datos (updated_at NULL) durante PRODUCT_FAILED_TTL; no se
+#   vuelve a pedir en cada ciclo y no bloquea la marca de sincronización. Pasado el TTL se reintenta.
+PRODUCT_CACHE_TTL = float(os.environ.get("TUVALUM_PRODUCT_TTL", 6 * 3600))
+PRODUCT_FAILED_TTL = float(os.environ.get("TUVALUM_PRODUCT_FAILED_TTL", 1800))
+PRODUCT_CACHE_MAX = int(os.environ.get("TUVALUM_PRODUCT_CACHE_MAX", 50000))
+
+def connect(db_path=None):
+    con = local_db.connect(db_path)
+    con.execute("CREATE TABLE IF NOT EXISTS products (product_id TEXT PRIMARY KEY, sku TEXT, updated_at TEXT, fetched_at REAL, last_used REAL, data TEXT)")
+    con.execute("CREATE INDEX IF NOT EXISTS idx_products_sku ON products(sku)")
+    con.execute("CREATE INDEX IF NOT EXISTS idx_products_used ON products(last_used)")
+    return con
+
+def _dump(d): return json.dumps({k: (v.isoformat() if isinstance(v, pd.Timestamp) else v) for k, v in d.items()})
+
+def _load(s):
+    d = json.loads(s)
+    if d.get("created_at"): d["created_at"] = pd.Timestamp(d["created_at"])
+    return d
+
+def lookup(product_ids, db_path=None):
+    # -> (frescos {pid: datos}, caducados {pid: (datos, updated_at)})
+    ids = [str(p) for p in dict.fromkeys(product_ids)]; fresh = {}; stale = {}; now = time.time()
+    if not ids: return fresh, stale
+    con = connect(db_path)
+    try:
+        for i in range(0, len(ids), 500):
+            part = ids[i:i + 500]
+            rows = con.execute(f"SELECT product_id, updated_at, fetched_at, data FROM products WHERE updated_at IS NOT NULL AND product_id IN ({','.join('?' * len(part))})", part).fetchall()
+            for pid, updated_at, fetched_at, data in rows:
+                if now - fetched_at <= PRODUCT_CACHE_TTL: fresh[pid] = _load(data)
+                else: stale[pid] = (_load(data), updated_at)
+        with con: con.executemany("UPDATE products SET last_used = ? WHERE product_id = ?", [(now, pid) for pid in list(fresh) + list(stale)])
+    finally: con.close()
+    return fresh, stale
+
+def lookup_sku(sku, db_path=None):
+    con = connect(db_path)
+    try: row = con.execute("SELECT data, fetched_at FROM products WHERE sku = ? ORDER BY fetched_at DESC LIMIT 1", (str(sku),)).fetchone()
+    finally: con.close()
+    if row and time.time() - row[1] <= PRODUCT_CACHE_TTL: return _load(row[0])
+    return None
+
+def by_sku(db_path=None, skip=()):
+    # -> {sku: datos} de los productos frescos con SKU conocido (el más reciente si se repite); `skip`: SKUs que no hace falta decodificar
+    con = connect(db_path)
+    try: rows = con.execute("SELECT sku, data FROM products WHERE sku IS NOT NULL AND sku != '' AND fetched_at >= ? ORDER BY fetched_at", (time.time() - PRODUCT_CACHE_TTL,)).fetchall()
+    finally: con.close()
+    return {str(sku).strip(): _load(data) for sku, data in rows if str(sku).strip() not in skip}
+
+def store(products, db_path=None):
+    # products: {pid: datos} con "updated_at" (y "sku" si se conoce). updated_at "" = producto borrado (caché negativa).
+    rows = [(str(pid), d.get("sku"), d["updated_at"], _dump(d)) for pid, d in products.items() if d.get("updated_at") is not None]
+    if not rows: return
+    now = time.time(); con = connect(db_path)
+    try:
+        with con:
+            con.executemany("INSERT INTO products (product_id, sku, updated_at, fetched_at, last_used, data) VALUES (?, ?, ?, ?, ?, ?) "
+                            "ON CONFLICT(product_id) DO UPDATE SET sku = COALESCE(excluded.sku, products.sku), updated_at = excluded.updated_at, fetched_at = excluded.fetched_at, last_used = excluded.last_used, data = excluded.data",
+                            [(pid, sku, upd, now, now, data) for pid, sku, upd, data in rows])
+            _evict(con)
+    finally: con.close()
+
+def failed(product_ids, db_path=None):
+    # -> pids apuntados como fallidos hace menos de PRODUCT_FAILED_TTL
+    ids = [str(p) for p in dict.fromkeys(product_ids)]; out = set()
+    if not ids: return out
+    con = connect(db_path)
+    try:
+        for i in range(0, len(ids), 500):
+            part = ids[i:i + 500]
+            out.update(pid for (pid,) in con.execute(f"SELECT product_id FROM products WHERE updated_at IS NULL AND fetched_at >= ? AND product_id IN ({','.join('?' * len(part))})", [time.time() - PRODUCT_FAILED_TTL, *part]))
+    finally: con.close()
+    return out
+
+def mark_failed(product_ids, db_path=None):
+    # Sin datos tras los reintentos: nunca pisa una entrada con datos (caducada incluida)
+    if not product_ids: return
+    now = time.time(); con = connect(db_path)
+    try:
+        with con:
+            con.executemany("INSERT INTO products (product_id, fetched_at, last_used) VALUES (?, ?, ?) ON CONFLICT(product_id) DO UPDATE SET fetched_at = excluded.fetched_at WHERE products.updated_at IS NULL",
+                            [(str(pid), now, now) for pid in product_ids])
+            _evict(con)
+    finally: con.close()
+
+def mark_revalidated(product_ids, db_path=None):
+    # updatedAt no ha cambiado: se reinicia el TTL sin volver a pedir el producto
+    if not product_ids: return
+    now = time.time(); con = connect(db_path)
+    try:
+        with con: con.executemany("UPDATE products SET fetched_at = ? WHERE product_id = ?", [(now, str(pid)) for pid in product_ids])
+    finally: con.close()
+
+def _evict(con):
+    n = con.execute("SELECT COUNT(*) FROM products").fetchone()[0]
+    if n > PRODUCT_CACHE_MAX: con.execute("DELETE FROM products WHERE product_id IN (SELECT product_id FROM products ORDER BY last_used ASC LIMIT ?)", (n - PRODUCT_CACHE_MAX,))
+
+def clear(db_path=None):
+    con = connect(db_path)
+    try:
+        with con: con.execute("DELETE FROM products")
+    finally: con.close()
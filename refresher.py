@@ -0,0 +1,93 @@
+import os
+import time
+import logging
+import threading
+import pandas as pd
+import order_store
+import inventory
+import inventory_history
+from shared_cache import SingleFlight, backend_from_url
+
+# ==============================================================================
+# REFRESCO EN SEGUNDO PLANO (STALE-WHILE-REVALIDATE)
+# ==============================================================================
+# Un hilo por proceso mantiene caliente el almacén local (pedidos + cubo + inventario). Las páginas leen siempre
+# la última foto buena; cada sincronización se escribe en una transacción SQLite y sólo después se sube `version`,
+# que es la clave de las cachés de la app: el cambio de datos es atómico para quien lee.
+# Sólo se bloquea la página la primera vez que se pide un periodo que el almacén todavía no cubre.
+# Varias réplicas sobre el mismo almacén: cada sincronización pasa por SingleFlight (shared_cache) y `version` es el contador
+# compartido, así que sólo una réplica llama a Shopify por ciclo y todas ven el cambio.
+REFRESH_INTERVAL = float(os.environ.get("TUVALUM_REFRESH_SECONDS", 300))
+log = logging.getLogger(__name__)
+
+class BackgroundRefresher:
+    def __init__(self, shop_url, token, interval=REFRESH_INTERVAL, db_path=None, flights=None):
+        self.shop_url = shop_url; self.token = token; self.interval = interval; self.db_path = db_path
+        self.flights = flights or SingleFlight(backend_from_url(db_path=db_path))
+        self.start = None; self.last_error = None; self.last_run = None; self._forced = False; self._active = set() # claves sincronizándose en este proceso
+        self._lock = threading.Lock(); self._wake = threading.Event(); self._thread = None
+
+    @property
+    def version(self): return self.flights.backend.counter("version")
+
+    @property
+    def running(self): return bool(self._active)
+
+    def orders_as_of(self): return order_store.data_as_of(self.db_path)
+
+    def inventory_as_of(self): return inventory.data_as_of(self.db_path)
+
+    def covers(self, start):
+        cov = order_store.coverage_start(self.db_path)
+        return cov is not None and cov <= pd.Timestamp(start)
+
+    def want(self, start):
+        # El hilo sincroniza siempre desde el periodo más antiguo que se haya pedido
+        with self._lock:
+            if self.start is None or pd.Timestamp(start) < self.start: self.start = pd.Timestamp(start)
+
+    def ensure_started(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._loop, name="tuvalum-refresher", daemon=True); self._thread.start()
+
+    def refresh_soon(self): self._forced = True; self._wake.set() # botón Actualizar / snapshot restaurado: no vale el ciclo reciente de otra réplica
+
+    def bump(self):
+        # Cambio aplicado fuera del hilo (webhook): nueva versión para las cachés de la app
+        self.flights.backend.incr("version")
+
+    def _run(self, key, fn, *args):
+        with self._lock: self._active.add(key)
+        try: fn(*args, self.shop_url, self.token, self.db_path)
+        finally:
+            with self._lock: self._active.discard(key)
+        self.bump()
+
+    def refresh_orders(self, start=None, fresh=0.0):
+        # Bloqueante: primera carga de un periodo o ciclo del hilo. Si otra sesión/réplica ya está sincronizando, se espera a la suya
+        # (o se aprovecha una de hace menos de `fresh` s) siempre que cubra el periodo pedido.
+        if start is not None: self.want(start)
+        # Un vuelo por clave: pedidos e inventario van en paralelo, SingleFlight ya serializa cada una (también entre hilos del proceso)
+        self.flights.run("orders", lambda: self._run("orders", order_store.sync_orders, self.start), fresh, enough=lambda: self.start is None or self.covers(self.start))
+
+    def _sync_inventory(self, shop_url, token, db_path):
+        # Recorrido + foto apuntada en el histórico diario (sólo lo que cambió); un fallo del histórico no tumba el refresco
+        inventory.refresh_inventory(shop_url, token, db_path)
+        try: inventory_history.record(inventory.load_inventory(db_path), hist_dir=inventory_history.history_dir(db_path=db_path))
+        except (OSError, ValueError) as e: log.warning("Histórico de inventario KO: %s", e)
+
+    def refresh_inventory(self, fresh=0.0):
+        self.flights.run("inventory", lambda: self._run("inventory", self._sync_inventory), fresh, enough=lambda: self.inventory_as_of() is not None)
+
+    def refresh_once(self):
+        fresh = 0.0 if self._forced else self.interval / 2; self._forced = False
+        if self.start is not None: self.refresh_orders(fresh=fresh)
+        self.refresh_inventory(fresh); self.last_run = time.time()
+
+    def _loop(self):
+        if self.inventory_as_of() is None: self._wake.set() # sin foto de inventario todavía: primer recorrido ya, no dentro de `interval`
+        while True:
+            self._wake.wait(self.interval); self._wake.clear()
+            try: self.refresh_once(); self.last_error = None
+            except Exception as e: self.last_error = e; log.exception("Refresco en segundo plano KO (se sigue sirviendo la última foto)")
@@ -0,0 +1,70 @@
+import pandas as pd
+
+# ==============================================================================
+# CUBO DIARIO PRE-AGREGADO (RESULTADOS / EVOLUCIÓN)
+# ==============================================================================
+# Una fila por día x status x canal x marketplace x tipo x marca x país x rango de precio,
+# con nº de ventas, ingresos, margen y suma de rotación. Se mantiene dentro de la misma
+# transacción que los pedidos: sólo se recalculan los días tocados por pedidos nuevos/cambiados.
+# Pedidos con producto sin resolver (margen NULL): tipo y marca PENDING, y fuera de ventas_enr / ingresos_enr, que son
+# el denominador de las medias de margen y rotación (el margen y la rotación de esos pedidos todavía no se conocen).
+PRICE_BINS = [0, 1000, 1500, 2500, 4000, 100000]
+PRICE_LABELS = ["<1k", "1k-1.5k", "1.5k-2.5k", "2.5k-4k", ">4k"]
+DIMS = ["status", "channel", "clean_mp", "type", "brand", "country", "price_band"]
+MEASURES = ["ventas", "ingresos", "margen", "rotation_sum", "ventas_enr", "ingresos_enr"]
+PENDING = "Pendiente"
+
+def _price_band_sql():
+    # Mismos tramos que pd.cut(bins=PRICE_BINS): (a, b]; fuera de rango -> NULL
+    cases = " ".join(f"WHEN total_ttc > {lo} AND total_ttc <= {hi} THEN '{lab}'" for lo, hi, lab in zip(PRICE_BINS[:-1], PRICE_BINS[1:], PRICE_LABELS))
+    return f"CASE {cases} END"
+
+def ensure_table(con):
+    cols = {r[1] for r in con.execute("PRAGMA table_info(rollup_daily)")}
+    if cols and not cols >= set(MEASURES): con.execute("DROP TABLE rollup_daily") # cubo de una versión anterior: se reconstruye entero
+    con.execute(f"CREATE TABLE IF NOT EXISTS rollup_daily (day TEXT, {', '.join(d + ' TEXT' for d in DIMS)}, ventas INTEGER, ingresos REAL, margen REAL, rotation_sum REAL, ventas_enr INTEGER, ingresos_enr REAL)")
+    con.execute("CREATE INDEX IF NOT EXISTS idx_rollup_day ON rollup_daily(day)")
+    if cols and not cols >= set(MEASURES) and con.execute("SELECT 1 FROM sqlite_master WHERE name = 'orders'").fetchone():
+        with con: rebuild(con)
+
+def _insert_select(where):
+    return (f"INSERT INTO rollup_daily (day, {', '.join(DIMS)}, {', '.join(MEASURES)}) "
+            f"SELECT substr(date, 1, 10) AS day, status, channel, clean_mp, COALESCE(type, '{PENDING}') AS type_d, COALESCE(brand, '{PENDING}') AS brand_d, country, {_price_band_sql()} AS price_band, "
+            f"COUNT(*), SUM(total_ttc), SUM(margin_real), SUM(rotation), COUNT(margin_real), SUM(CASE WHEN margin_real IS NOT NULL THEN total_ttc END) "
+            f"FROM orders {where} GROUP BY day, status, channel, clean_mp, type_d, brand_d, country, price_band")
+
+def touched_days(con, order_ids):
+    # Días donde estaban estos pedidos antes del cambio (un pedido puede cambiar de status o desaparecer)
+    days = set(); ids = [int(i) for i in order_ids]
+    for i in range(0, len(ids), 500):
+        part = ids[i:i + 500]
+        days.update(r[0] for r in con.execute(f"SELECT DISTINCT substr(date, 1, 10) FROM orders WHERE order_id IN ({','.join('?' * len(part))})", part))
+    return days
+
+def refresh_days(con, days):
+    days = sorted(d for d in days if d)
+    for i in range(0, len(days), 500):
+        part = days[i:i + 500]; ph = ",".join("?" * len(part))
+        con.execute(f"DELETE FROM rollup_daily WHERE day IN ({ph})", part)
+        con.execute(_insert_select(f"WHERE substr(date, 1, 10) IN ({ph})"), part)
+
+def rebuild(con):
+    con.execute("DELETE FROM rollup_daily"); con.execute(_insert_select(""))
+
+def read_rollup(con, start=None, end=None):
+    ensure_table(con)
+    if not con.execute("SELECT EXISTS(SELECT 1 FROM rollup_daily)").fetchone()[0] and con.execute("SELECT EXISTS(SELECT 1 FROM orders)").fetchone()[0]:
+        with con: rebuild(con) # base anterior al cubo
+    q = "SELECT * FROM rollup_daily"; args = []; where = []
+    if start is not None: where.append("day >= ?"); args.append(pd.Timestamp(start).strftime("%Y-%m-%d"))
+    if end is not None: where.append("day <= ?"); args.append(pd.Timestamp(end).strftime("%Y-%m-%d"))
+    if where: q += " WHERE " + " AND ".join(where)
+    df = pd.read_sql_query(q, con, params=args)
+    df["day"] = pd.to_datetime(df["day"])
+    return df
+
+def slice_days(cube, start, end):
+    # Días completos [start, end] (end puede llevar hora 23:59:59)
+    return cube[(cube["day"] >= pd.Timestamp(start).normalize()) & (cube["day"] <= pd.Timestamp(end).normalize())]
+
+def count_by(cube, dim, name="c"): return cube.groupby(dim)["ventas"].sum().reset_index(name=name)
@@ -0,0 +1,126 @@
+import os
+import time
+import uuid
+import logging
+import threading
+import local_db
+import metrics
+try: import redis
+except ImportError: redis = None # sin el cliente redis: sólo backend SQLite
+
+# ==============================================================================
+# CACHÉ COMPARTIDA ENTRE PROCESOS + SINGLE-FLIGHT (VARIAS RÉPLICAS, UN SOLO ESCANEO)
+# ==============================================================================
+# Varias sesiones o réplicas de Streamlit sobre el mismo TUVALUM_DATA_DIR: sólo una sincroniza cada clave ("orders", "inventory")
+# contra Shopify a la vez; las demás esperan a que termine y leen su resultado del almacén local, sin repetir la llamada.
+# - Backend por defecto: SQLite (shared.db junto a la base). TUVALUM_CACHE_URL=redis://... -> Redis o cualquier sustituto compatible.
+# - El lock es un arriendo (FLIGHT_LEASE) que el dueño renueva mientras trabaja: un proceso muerto no lo bloquea para siempre.
+# - "version" es un contador compartido: una sincronización (o un webhook) en una réplica cambia la clave de caché en todas.
+CACHE_URL = os.environ.get("TUVALUM_CACHE_URL", "")
+FLIGHT_LEASE = float(os.environ.get("TUVALUM_FLIGHT_LEASE", 60))
+FLIGHT_POLL = 0.25
+FLIGHT_WAIT = float(os.environ.get("TUVALUM_FLIGHT_WAIT", 900)) # espera máxima por el dueño de un lock
+log = logging.getLogger(__name__)
+
+class SQLiteBackend:
+    # Fichero aparte de la base: restaurar un snapshot no hace retroceder los contadores
+    def __init__(self, path=None): self.path = path
+
+    def connect(self):
+        con = local_db.connect(self.path or os.path.join(os.path.dirname(local_db.DB_PATH), "shared.db"))
+        con.execute("CREATE TABLE IF NOT EXISTS flights (key TEXT PRIMARY KEY, owner TEXT, expires REAL, done REAL)")
+        con.execute("CREATE TABLE IF NOT EXISTS counters (key TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+        return con
+
+    def _write(self, q, args):
+        con = self.connect()
+        try:
+            with con: return con.execute(q, args).rowcount
+        finally: con.close()
+
+    def _read(self, q, args):
+        con = self.connect()
+        try: row = con.execute(q, args).fetchone()
+        finally: con.close()
+        return row[0] if row else None
+
+    def acquire(self, key, owner, lease):
+        now = time.time(); con = self.connect()
+        try:
+            with con:
+                con.execute("INSERT OR IGNORE INTO flights (key) VALUES (?)", (key,))
+                return con.execute("UPDATE flights SET owner = ?, expires = ? WHERE key = ? AND (owner IS NULL OR expires < ?)", (owner, now + lease, key, now)).rowcount == 1
+        finally: con.close()
+
+    def extend(self, key, owner, lease): self._write("UPDATE flights SET expires = ? WHERE key = ? AND owner = ?", (time.time() + lease, key, owner))
+
+    def release(self, key, owner, done=None): self._write("UPDATE flights SET owner = NULL, expires = NULL, done = COALESCE(?, done) WHERE key = ? AND owner = ?", (done, key, owner))
+
+    def done(self, key): return self._read("SELECT done FROM flights WHERE key = ?", (key,))
+
+    def incr(self, key): self._write("INSERT INTO counters (key, value) VALUES (?, 1) ON CONFLICT(key) DO UPDATE SET value = value + 1", (key,))
+
+    def counter(self, key): return self._read("SELECT value FROM counters WHERE key = ?", (key,)) or 0
+
+class RedisBackend:
+    # Sólo SET NX PX / GET / INCR / EVAL: vale cualquier servidor compatible con el protocolo Redis (con Lua)
+    # Renovar y soltar comparan el dueño y actúan en el mismo script: si el arriendo caducó y lo tiene otra réplica, no se toca.
+    EXTEND = "if redis.call('get', KEYS[1]) == ARGV[1] then return redis.call('pexpire', KEYS[1], ARGV[2]) end return 0"
+    RELEASE = "if redis.call('get', KEYS[1]) == ARGV[1] then return redis.call('del', KEYS[1]) end return 0"
+
+    def __init__(self, client, prefix="tuvalum:"): self.client = client; self.prefix = prefix
+
+    def acquire(self, key, owner, lease): return bool(self.client.set(f"{self.prefix}lock:{key}", owner, nx=True, px=int(lease * 1000)))
+
+    def extend(self, key, owner, lease): self.client.eval(self.EXTEND, 1, f"{self.prefix}lock:{key}", owner, int(lease * 1000))
+
+    def release(self, key, owner, done=None):
+        if done is not None: self.client.set(f"{self.prefix}done:{key}", repr(done))
+        self.client.eval(self.RELEASE, 1, f"{self.prefix}lock:{key}", owner)
+
+    def done(self, key):
+        v = self.client.get(f"{self.prefix}done:{key}")
+        return float(v) if v is not None else None
+
+    def incr(self, key): self.client.incr(f"{self.prefix}{key}")
+
+    def counter(self, key): return int(self.client.get(f"{self.prefix}{key}") or 0)
+
+def backend_from_url(url=None, db_path=None):
+    # "" -> SQLite junto a db_path (o a local_db.DB_PATH en el momento de usarlo); "redis://host:6379/0" -> Redis. RuntimeError si falta el cliente.
+    url = CACHE_URL if url is None else url
+    if url.startswith(("redis://", "rediss://", "unix://")):
+        if redis is None: raise RuntimeError(f"TUVALUM_CACHE_URL={url} necesita el paquete redis")
+        return RedisBackend(redis.Redis.from_url(url))
+    return SQLiteBackend(os.path.join(os.path.dirname(db_path), "shared.db") if db_path else None)
+
+class SingleFlight:
+    def __init__(self, backend=None, lease=FLIGHT_LEASE, poll=FLIGHT_POLL, max_wait=FLIGHT_WAIT): self.backend = backend or SQLiteBackend(); self.lease = lease; self.poll = poll; self.max_wait = max_wait
+
+    def _beat(self, key, owner, stop):
+        while not stop.wait(self.lease / 3): self.backend.extend(key, owner, self.lease)
+
+    def _shared(self, key, asked, fresh, enough):
+        done = self.backend.done(key)
+        return done is not None and done >= asked - fresh and (enough is None or enough())
+
+    def run(self, key, fn, fresh=0.0, enough=None):
+        # -> True si fn se ejecutó aquí; False si vale la de otro (terminada después de la llamada, o hace menos de `fresh` s, y enough() se cumple).
+        # Quien espera mira también la marca `done`: en cuanto la de otro termina se usa su resultado, sin pelear por el lock.
+        # Si la de otro falla, quien espera lo intenta él mismo: el error no se comparte. Pasados `max_wait` s (dueño colgado que
+        # sigue renovando) se ejecuta fn aquí sin el lock: mejor una sincronización repetida que todas las sesiones paradas.
+        asked = time.time(); owner = uuid.uuid4().hex # uno por llamada: hilos del mismo proceso también esperan
+        with metrics.span("flight.wait", label=key):
+            while not (got := self.backend.acquire(key, owner, self.lease)):
+                if self._shared(key, asked, fresh, enough) or time.time() - asked > self.max_wait: break
+                time.sleep(self.poll)
+        if self._shared(key, asked, fresh, enough):
+            if got: self.backend.release(key, owner)
+            metrics.record("flight.shared", 0.0, label=key); return False
+        if not got:
+            log.warning("Single-flight %s: más de %.0f s esperando al dueño del lock, se sincroniza aquí", key, self.max_wait); metrics.record("flight.timeout", 0.0, label=key)
+            fn(); return True
+        stop = threading.Event(); threading.Thread(target=self._beat, args=(key, owner, stop), name=f"tuvalum-flight-{key}", daemon=True).start(); ok = False
+        try: fn(); ok = True
+        finally: stop.set(); self.backend.release(key, owner, time.time() if ok else None)
+        return True
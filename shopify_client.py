@@ -0,0 +1,87 @@
+import os
+import time
+import random
+import logging
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+import metrics
+
+# ==============================================================================
+# CLIENTE SHOPIFY COMPARTIDO (SESSION + POOL, GZIP, REINTENTOS 429/5XX)
+# ==============================================================================
+# Un cliente por tienda y proceso: conexiones keep-alive reutilizadas por pedidos, GraphQL, inventario y búsqueda SKU.
+# - 429: se espera Retry-After (o backoff exponencial) y se reintenta: un throttle ya no corta la paginación.
+# - 5xx / errores de red: backoff exponencial con jitter, hasta SHOPIFY_MAX_RETRIES.
+# - REST: se lee X-Shopify-Shop-Api-Call-Limit ("32/40") y se frena antes de llenar el cubo.
+# - El token sólo viaja en las peticiones a la tienda (nunca al JSONL de las Bulk Operations).
+SHOPIFY_CONNECT_TIMEOUT = float(os.environ.get("SHOPIFY_CONNECT_TIMEOUT", 5))
+SHOPIFY_READ_TIMEOUT = float(os.environ.get("SHOPIFY_READ_TIMEOUT", 60))
+SHOPIFY_MAX_RETRIES = int(os.environ.get("SHOPIFY_MAX_RETRIES", 5))
+SHOPIFY_POOL_SIZE = 10
+REST_BUCKET_HEADROOM = 0.8 # por encima de este llenado del cubo REST se espera a que se vacíe
+REST_LEAK_RATE = 2.0 # llamadas/s que libera el cubo REST (plan estándar)
+RETRY_STATUS = {429, 500, 502, 503, 504}
+log = logging.getLogger(__name__)
+
+def _backoff(attempt, base=0.5, cap=30.0): return min(cap, base * 2 ** attempt) * (0.5 + random.random() / 2)
+
+def _retry_after(r, attempt):
+    try: return max(0.0, float(r.headers.get("Retry-After")))
+    except (TypeError, ValueError): return _backoff(attempt)
+
+class ShopifyClient:
+    def __init__(self, token, timeout=None, max_retries=SHOPIFY_MAX_RETRIES, pool_size=SHOPIFY_POOL_SIZE):
+        self.token = token; self.timeout = timeout or (SHOPIFY_CONNECT_TIMEOUT, SHOPIFY_READ_TIMEOUT); self.max_retries = max_retries
+        self.session = requests.Session(); adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter); self.session.mount("http://", adapter)
+        self.session.headers.update({"Accept-Encoding": "gzip, deflate", "Accept": "application/json"})
+
+    def _pace_rest(self, r):
+        # "32/40": cubo casi lleno -> esperar lo que tarda en volver a REST_BUCKET_HEADROOM
+        try: used, size = (float(x) for x in r.headers.get("X-Shopify-Shop-Api-Call-Limit", "").split("/"))
+        except ValueError: return
+        if used >= size * REST_BUCKET_HEADROOM: time.sleep((used - size * REST_BUCKET_HEADROOM + 1) / REST_LEAK_RATE)
+
+    def _request(self, method, url, kind, parse_json, **kw):
+        headers = {"X-Shopify-Access-Token": self.token, **kw.pop("headers", {})}; kw.setdefault("timeout", self.timeout)
+        for attempt in range(self.max_retries + 1):
+            last = attempt == self.max_retries; payload = None
+            try:
+                with metrics.span(kind) as h:
+                    r = self.session.request(method, url, headers=headers, **kw); h["bytes"] = len(r.content)
+                    if r.status_code != 200: h["errors"] += 1
+                    elif parse_json: payload = r.json(); h["cost"] = metrics.gql_cost(payload)
+            except (requests.ConnectionError, requests.Timeout):
+                if last: raise
+                time.sleep(_backoff(attempt)); continue
+            if r.status_code in RETRY_STATUS and not last:
+                wait = _retry_after(r, attempt) if r.status_code == 429 else _backoff(attempt)
+                metrics.record(kind + ".retry", wait, retries=1); log.info("Shopify %s en %s, reintento en %.1fs", r.status_code, url.split("?")[0], wait)
+                time.sleep(wait); continue
+            if kind == "shopify.rest": self._pace_rest(r)
+            return r, payload
+
+    def request(self, method, url, kind="shopify.rest", **kw):
+        # -> Response (la última, aunque sea un error tras agotar los reintentos). requests.RequestException si la red falla en todos los intentos.
+        return self._request(method, url, kind, False, **kw)[0]
+
+    def get(self, url, **kw): return self.request("GET", url, **kw)
+
+    def graphql(self, url, query, variables=None, **kw):
+        # -> (payload, Response). ValueError si la respuesta no es JSON.
+        # Los errores THROTTLED de GraphQL (HTTP 200) se dejan al llamador, que lleva su propio cubo de coste.
+        r, payload = self._request("POST", url, "shopify.graphql", True, json={"query": query, "variables": variables or {}}, **kw)
+        return (payload if payload is not None else r.json()), r
+
+    def download(self, url, **kw):
+        # URL externa (JSONL de una Bulk Operation): sin token, en streaming
+        kw.setdefault("timeout", (SHOPIFY_CONNECT_TIMEOUT, 300))
+        return self.session.get(url, stream=True, **kw)
+
+_clients = {}; _clients_lock = threading.Lock()
+
+def get_client(token):
+    with _clients_lock:
+        if token not in _clients: _clients[token] = ShopifyClient(token)
+        return _clients[token]
@@ -0,0 +1,65 @@
+import json
+import bisect
+import threading
+import pandas as pd
+import inventory
+import product_cache
+
+# ==============================================================================
+# ÍNDICE SKU EN MEMORIA (CALCULADORA MARGEN & DTO)
+# ==============================================================================
+# Construido sin llamar a Shopify desde la foto local de inventario y, para lo que no está en ella (vendidas, buscadas antes...),
+# desde la caché de producto: búsqueda exacta en un dict y autocompletado por prefijo con bisect sobre la tupla ordenada de SKUs.
+# Lo que no está en ninguna de las dos sigue yendo a search_sku_live y se memoriza aquí.
+# Un índice para todas las sesiones (cache_resource): `add` cambia `keys` por una tupla nueva bajo lock, así que quien la esté
+# recorriendo (opciones del selectbox de otra sesión) sigue con la suya intacta.
+NO_SPECS = {"state": "-", "year": "-", "size": "-", "frame": "-", "wheels": "-", "group": "-", "brakes": "-", "ebike": None, "inv": 1}
+
+class SkuIndex:
+    def __init__(self, entries=None):
+        self.entries = dict(entries or {}); self.keys = tuple(sorted(self.entries)); self.lock = threading.Lock()
+
+    def __len__(self): return len(self.entries)
+
+    def get(self, sku): return self.entries.get(str(sku).strip())
+
+    def add(self, sku, result):
+        sku = str(sku).strip()
+        with self.lock:
+            if sku not in self.entries: keys = list(self.keys); bisect.insort(keys, sku); self.keys = tuple(keys)
+            self.entries[sku] = result
+
+    def prefix(self, p, limit=10):
+        p = str(p).strip(); keys = self.keys; i = bisect.bisect_left(keys, p); out = []
+        while i < len(keys) and keys[i].startswith(p) and len(out) < limit: out.append(keys[i]); i += 1
+        return out
+
+    def label(self, sku):
+        e = self.entries.get(sku)
+        return f"{sku} · {e['title']}" if e else str(sku)
+
+def row_to_result(row):
+    # Fila de inventario -> mismo dict que search_sku_live
+    specs = json.loads(row["specs"]) if row.get("specs") else NO_SPECS
+    return {"found": True, "title": row["title"], "cost": float(row["cost"] or 0.0), "price": float(row["price_curr"] or 0.0), "created_at": pd.Timestamp(row["created_at"]) if row.get("created_at") else pd.NaT,
+            "fiscal": row["fiscal"] or "PRO", "img": row["img"], "specs": specs}
+
+def cached_to_result(d):
+    # Producto de la caché (nodo completo de inventario o de búsqueda) -> mismo dict; None si le falta título o precio (sólo coste de un pedido)
+    if not d or not d.get("title") or d.get("price") is None: return None
+    return {"found": True, "title": d["title"], "cost": float(d.get("cost") or 0.0), "price": float(d["price"]), "created_at": pd.Timestamp(d["created_at"]) if d.get("created_at") else pd.NaT,
+            "fiscal": d.get("fiscal") or "PRO", "img": d.get("img"), "specs": d.get("specs") or NO_SPECS}
+
+def lookup_cached(sku, db_path=None): return cached_to_result(product_cache.lookup_sku(str(sku).strip(), db_path))
+
+def build_sku_index(db_path=None):
+    con = inventory.connect(db_path)
+    try:
+        cur = con.execute("SELECT sku, title, img, created_at, price_curr, cost, fiscal, specs FROM inventory WHERE sku IS NOT NULL AND sku != ''"); cols = [c[0] for c in cur.description]
+        rows = [dict(zip(cols, r)) for r in cur.fetchall()]
+    finally: con.close()
+    entries = {str(r["sku"]).strip(): row_to_result(r) for r in rows} # la foto de inventario manda sobre la caché
+    for sku, d in product_cache.by_sku(db_path, skip=entries).items():
+        r = cached_to_result(d)
+        if r: entries[sku] = r
+    return SkuIndex(entries)
@@ -0,0 +1,81 @@
+import os
+import re
+import json
+import sqlite3
+import logging
+import pandas as pd
+import local_db
+import order_store
+import inventory
+import metrics
+
+# ==============================================================================
+# SNAPSHOTS VERSIONADOS DEL ALMACÉN LOCAL (ARRANQUE EN CALIENTE)
+# ==============================================================================
+# tools/precompute.py construye fuera de la app pedidos + cubo + inventario + caché de producto y los congela en
+# SNAPSHOT_DIR/tuvalum-AAAAMMDDTHHMMSSZ.db (copia SQLite consistente) + .json (marcas y recuentos).
+# Al arrancar, la app restaura el más reciente si es más nuevo que su base: el refresco sólo pide el delta desde su marca.
+SNAPSHOT_DIR = os.environ.get("TUVALUM_SNAPSHOT_DIR", "snapshots")
+SNAPSHOT_KEEP = 3
+SNAPSHOT_RE = re.compile(r"^tuvalum-(\d{8}T\d{6}Z)\.db$")
+log = logging.getLogger(__name__)
+
+def list_snapshots(snap_dir=None):
+    # -> rutas, de la más nueva a la más antigua
+    snap_dir = snap_dir or SNAPSHOT_DIR
+    if not os.path.isdir(snap_dir): return []
+    return [os.path.join(snap_dir, f) for f in sorted((f for f in os.listdir(snap_dir) if SNAPSHOT_RE.match(f)), reverse=True)]
+
+def read_manifest(path):
+    try:
+        with open(path[:-3] + ".json") as f: return json.load(f)
+    except (OSError, ValueError): return None
+
+def _copy(src, dst):
+    # API de backup de SQLite: copia consistente aunque otra conexión esté escribiendo
+    s = sqlite3.connect(src, timeout=30); d = sqlite3.connect(dst, timeout=30)
+    try:
+        with d: s.backup(d)
+    finally: d.close(); s.close()
+
+def _restore(src, db_path):
+    # Snapshot -> base viva a través de una conexión normal (WAL + busy timeout de local_db), nunca copiando ficheros encima:
+    # SQLite toma el lock de escritura, pasa las páginas por el WAL y las conexiones abiertas (refresco, webhooks, otra réplica)
+    # ven la base nueva entera en su siguiente lectura. La base sigue en modo WAL y los -wal/-shm cuadran con ella.
+    s = sqlite3.connect(f"file:{src}?mode=ro", uri=True, timeout=30); d = local_db.connect(db_path)
+    try: s.backup(d)
+    finally: d.close(); s.close()
+
+@metrics.timed("snapshot.write")
+def write_snapshot(db_path=None, snap_dir=None, keep=SNAPSHOT_KEEP, now=None):
+    # -> (ruta, manifiesto). Se escribe a .tmp y se renombra: un lector nunca ve un snapshot a medias.
+    db_path = db_path or local_db.DB_PATH; snap_dir = snap_dir or SNAPSHOT_DIR; os.makedirs(snap_dir, exist_ok=True)
+    now = pd.Timestamp(now if now is not None else pd.Timestamp.now(tz="UTC"))
+    path = os.path.join(snap_dir, f"tuvalum-{now:%Y%m%dT%H%M%SZ}.db"); _copy(db_path, path + ".tmp")
+    con = sqlite3.connect(path + ".tmp")
+    try:
+        with con: con.execute("PRAGMA journal_mode=DELETE") # un solo fichero, sin -wal al lado
+        counts = {t: con.execute(f"SELECT COUNT(*) FROM {t}").fetchone()[0] for t in ("orders", "rollup_daily", "inventory", "products") if con.execute("SELECT 1 FROM sqlite_master WHERE name = ?", (t,)).fetchone()}
+        state = dict(con.execute("SELECT key, value FROM sync_state WHERE key NOT LIKE 'shard:%'").fetchall())
+    finally: con.close()
+    manifest = {"created": now.isoformat(), "file": os.path.basename(path), "counts": counts, "state": state}
+    os.replace(path + ".tmp", path)
+    with open(path[:-3] + ".json", "w") as f: json.dump(manifest, f, indent=2)
+    for old in list_snapshots(snap_dir)[keep:]:
+        for p in (old, old[:-3] + ".json"):
+            try: os.remove(p)
+            except OSError: pass
+    return path, manifest
+
+def restore_latest(db_path=None, snap_dir=None):
+    # -> manifiesto restaurado, o None si no hay snapshot o la base local ya es igual o más nueva
+    db_path = db_path or local_db.DB_PATH; snaps = list_snapshots(snap_dir)
+    if not snaps: return None
+    manifest = read_manifest(snaps[0]); snap_wm = (manifest or {}).get("state", {}).get("watermark")
+    local_as_of = order_store.data_as_of(db_path) if os.path.exists(db_path) else None
+    if snap_wm is None or (local_as_of is not None and local_as_of >= pd.Timestamp(snap_wm) + order_store.SYNC_OVERLAP): return None
+    with metrics.span("snapshot.restore"):
+        _restore(snaps[0], db_path)
+        order_store.connect(db_path).close(); inventory.connect(db_path).close() # tablas/columnas añadidas después del snapshot
+    log.info("Snapshot %s restaurado (marca %s)", snaps[0], snap_wm)
+    return manifest
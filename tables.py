@@ -0,0 +1,79 @@
+import tempfile
+import numpy as np
+import pandas as pd
+import metrics
+import order_store
+from data_engine import format_raw_price
+try: import pyarrow as pa; import pyarrow.parquet as pq
+except ImportError: pa = pq = None # sin pyarrow: sólo exportación CSV
+
+# ==============================================================================
+# TABLA VENTAS: FORMATO Y ESTILOS (SIN STREAMLIT)
+# ==============================================================================
+# - Paginada en el servidor: sólo las PAGE_SIZE filas visibles pasan por el Styler (y viajan al navegador).
+# - Orden, margen acumulado y franjas por día se calculan vectorizados sobre el periodo completo.
+PAGE_SIZE = 100
+TABLE_COLS = ["#", "date_str", "order_name", "canal_full", "country", "cat", "subcat", "sku", "type", "cost", "raw_price_str", "total_ttc", "discount", "commission", "margin_real", "margin_cum"]
+STRIPE_CSS = ("background-color: white", "background-color: #f8f9fa")
+
+def page_count(n, page_size=PAGE_SIZE): return max(1, -(-n // page_size))
+
+def sales_table_rows(df_input, is_mp=False):
+    # -> (frame ordenado, franja por fila: True = día par en gris)
+    df_show = df_input
+    if is_mp:
+        df_show = df_show.sort_values("date", ascending=True)
+        df_show = df_show.assign(margin_cum=df_show["margin_real"].cumsum()).sort_values("date", ascending=False).reset_index(drop=True)
+        df_show["#"] = range(len(df_show), 0, -1)
+    day = df_show["date"].dt.normalize()
+    return df_show, ((day != day.shift()).cumsum() % 2 == 0).to_numpy()
+
+@metrics.timed("table.style")
+def sales_table_styler(df_input, t, is_mp=False, page=0, page_size=PAGE_SIZE):
+    df_rows, stripe = sales_table_rows(df_input, is_mp)
+    sl = slice(page * page_size, (page + 1) * page_size); df_show = df_rows.iloc[sl]; band = stripe[sl]
+
+    channel = df_show["channel"].astype(str)
+    df_show = df_show.assign(canal_full=np.where(channel == "Marketplace", channel + " (" + df_show["mp_name"].astype(str) + ")", channel),
+                             date_str=df_show["date"].dt.strftime("%d/%m/%Y"), raw_price_str=format_raw_price(df_show["raw_price_val"], df_show["currency_code"]))
+    col_names = ["#", t["col_date"], t["col_order"], t["col_channel"], t["col_country"], t["col_cat"], t["col_subcat"], t["col_sku"], t["col_type"], t["col_cost"], t["col_cambio"], t["col_price"], t["col_disc"], t["col_comm"], t["col_margin"], t["col_margin_tot"]]
+
+    df_final = df_show[TABLE_COLS].reset_index(drop=True); df_final.columns = col_names
+
+    styler = df_final.style.format(na_rep="-", formatter={
+        t["col_cost"]: "{:,.0f} €", t["col_price"]: "{:,.0f} €", t["col_margin"]: "{:,.0f} €", t["col_margin_tot"]: "{:,.0f} €",
+        t.get("col_disc","Dto."): "{:,.0f} €", t.get("col_comm","Comisión"): "{:,.0f} €"
+    })
+    styler = styler.set_properties(subset=[t["col_margin"], t["col_margin_tot"]], **{'background-color': '#d1fae5', 'color': '#0a4650', 'font-weight': 'bold'})
+    css = np.repeat(np.where(band, STRIPE_CSS[1], STRIPE_CSS[0])[:, None], len(col_names), axis=1)
+    styler = styler.apply(lambda d: pd.DataFrame(css, index=d.index, columns=d.columns), axis=None)
+    return styler
+
+# ==============================================================================
+# EXPORTACIÓN DEL PERIODO (CSV / PARQUET) EN TROZOS, SIN STYLER
+# ==============================================================================
+# Se lee de SQLite en trozos de EXPORT_CHUNK_ROWS y se escribe a un fichero temporal (en memoria hasta EXPORT_SPOOL_MB).
+EXPORT_COLS = ["date", "order_name", "channel", "mp_name", "country", "cat", "subcat", "sku", "type", "brand", "cost", "currency_code", "raw_price_val", "total_ttc", "discount", "commission", "margin_real", "rotation"]
+EXPORT_CHUNK_ROWS = 20000
+EXPORT_SPOOL_MB = 32
+EXPORT_FORMATS = {"csv": "text/csv", "parquet": "application/vnd.apache.parquet"}
+
+def _arrow_schema():
+    # Fijo para todos los trozos (un trozo con una columna vacía no debe cambiar el tipo)
+    kinds = {"REAL": pa.float64(), "INTEGER": pa.int64()}
+    return pa.schema([(c, pa.timestamp("ns") if c == "date" else kinds.get(order_store.ORDER_SCHEMA[c].split()[0], pa.string())) for c in EXPORT_COLS])
+
+@metrics.timed("table.export")
+def export_orders(start, end, fmt="csv", status="paid", chunksize=EXPORT_CHUNK_ROWS, db_path=None):
+    # -> bytes del fichero. ValueError si el formato no está disponible.
+    if fmt not in EXPORT_FORMATS or (fmt == "parquet" and pq is None): raise ValueError(f"Formato de exportación no disponible: {fmt}")
+    chunks = order_store.iter_orders(start, end, status=status, columns=EXPORT_COLS, chunksize=chunksize, db_path=db_path)
+    with tempfile.SpooledTemporaryFile(max_size=EXPORT_SPOOL_MB * 2**20) as out:
+        if fmt == "parquet":
+            schema = _arrow_schema()
+            with pq.ParquetWriter(out, schema) as writer:
+                for chunk in chunks: writer.write_table(pa.Table.from_pandas(chunk, schema=schema, preserve_index=False))
+        else:
+            for i, chunk in enumerate(chunks): out.write(chunk.to_csv(index=False, header=i == 0, date_format="%Y-%m-%d %H:%M:%S").encode("utf-8"))
+            if not out.tell(): out.write((",".join(EXPORT_COLS) + "\n").encode("utf-8")) # periodo vacío: sólo cabecera
+        out.seek(0); return out.read()
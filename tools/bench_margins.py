@@ -0,0 +1,70 @@
+import time
+import argparse
+import pandas as pd
+from tools.fake_shopify import FakeShop
+from data_engine import OrderBuffer, parse_product_node, enrich_orders, DEFAULT_PRODUCT, EXCHANGE_RATES, ENRICH_COLS
+
+# ==============================================================================
+# BENCHMARK MARGENES: MOTOR VECTORIZADO vs ANTIGUO apply_data FILA A FILA
+# ==============================================================================
+# python -m tools.bench_margins --orders 25000
+
+def enrich_orders_rowwise(df_ord, COST_MAP):
+    # Implementación de referencia (antiguo apply_data), sólo para medir y comparar resultados
+    def apply_data(row):
+        pid = row["parent_id"]; price = row["total_ttc"]; d = COST_MAP.get(pid, DEFAULT_PRODUCT)
+        cost = d["cost"]; fiscal = str(d["fiscal"]).upper()
+        comm_mp = 0.0
+        if row["channel"] == "Marketplace":
+            mp_low = str(row["mp_name"]).lower(); local_price = row["raw_price_val"]; curr = row["currency_code"]
+            if "alltricks" in mp_low:
+                 c_val = local_price * 0.10
+                 if curr == "EUR" and c_val > 150.0: c_val = 150.0
+                 comm_mp = c_val
+            elif "decathlon" in mp_low:
+                 if curr == "PLN": c_val = local_price * 0.11; comm_mp = 1210.0 if c_val > 1210.0 else c_val
+                 elif curr == "RON": c_val = local_price * 0.11; comm_mp = 1320.0 if c_val > 1320.0 else c_val
+                 elif curr == "HUF": c_val = local_price * 0.11; comm_mp = 10450.0 if c_val > 10450.0 else c_val
+                 else: c_val = local_price * 0.11; comm_mp = 275.0 if c_val > 275.0 else c_val
+            elif "campsider" in mp_low: comm_mp = local_price * 0.10
+            elif "refurbed" in mp_low: comm_mp = local_price * 0.10
+            elif "ebikemood" in mp_low: comm_mp = local_price * 0.06
+            else: comm_mp = local_price * 0.10
+            if curr != "EUR": rate = EXCHANGE_RATES.get(curr, 0.0); comm_mp = comm_mp * rate
+        margin = 0.0
+        if cost > 0:
+            if "REBU" in fiscal: margin = ((price - cost) / 1.21) - comm_mp
+            elif "INTRA" in fiscal: margin = (price - cost) - comm_mp
+            else: margin = ((price / 1.21) - (cost / 1.21)) - comm_mp
+        rot = (row["date"] - d["created_at"]).days if d["created_at"] else 0
+        return pd.Series([cost, fiscal, margin, d["brand"], d["cat"], d["subcat"], d["type"], max(0, rot), comm_mp])
+    df_ord[ENRICH_COLS] = df_ord.apply(apply_data, axis=1)
+    cols_to_round = ["cost", "total_ttc", "margin_real", "discount", "commission"]
+    df_ord[cols_to_round] = df_ord[cols_to_round].round(0)
+    return df_ord
+
+def synthetic_input(n_orders, seed=42):
+    shop = FakeShop(n_orders, n_products=max(50, n_orders // 2), seed=seed)
+    df = OrderBuffer().extend(shop.orders).frame()
+    cost_map = {str(pid): parse_product_node(shop.product_node(p)) for pid, p in shop.products.items()}
+    return df, cost_map
+
+def run(n_orders, repeat=3):
+    df, cost_map = synthetic_input(n_orders); res = {"orders": len(df)}
+    for name, fn in (("rowwise", enrich_orders_rowwise), ("vectorized", enrich_orders)):
+        best = float("inf")
+        for _ in range(repeat):
+            d = df.copy(); t = time.perf_counter(); out = fn(d, cost_map); best = min(best, time.perf_counter() - t)
+        res[name] = {"seconds": round(best, 4), "rows_per_s": round(len(df) / best)}; res[name + "_frame"] = out
+    a = res.pop("rowwise_frame"); b = res.pop("vectorized_frame")
+    pd.testing.assert_frame_equal(a[ENRICH_COLS].astype(b[ENRICH_COLS].dtypes.to_dict()), b[ENRICH_COLS], check_dtype=False)
+    res["speedup"] = round(res["rowwise"]["seconds"] / res["vectorized"]["seconds"], 1)
+    return res
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Benchmark del motor de márgenes")
+    ap.add_argument("--orders", type=int, nargs="+", default=[1000, 25000]); ap.add_argument("--repeat", type=int, default=3)
+    a = ap.parse_args()
+    for n in a.orders:
+        r = run(n, a.repeat)
+        print(f"{r['orders']:>7} pedidos | fila a fila {r['rowwise']['rows_per_s']:>10,} filas/s | vectorizado {r['vectorized']['rows_per_s']:>12,} filas/s | x{r['speedup']}")
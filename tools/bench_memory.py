@@ -0,0 +1,51 @@
+import os
+import json
+import time
+import pickle
+import argparse
+import tempfile
+import pandas as pd
+import order_store
+from tools.bench_margins import synthetic_input
+from data_engine import enrich_orders, format_raw_price
+
+# ==============================================================================
+# BENCHMARK MEMORIA: FRAME DE PEDIDOS "OBJETO" vs COMPACTO (CATEGORÍAS + FLOAT32)
+# ==============================================================================
+# python -m tools.bench_memory --orders 25000 100000 [--out mem.json]
+# - "legacy": lo que devolvía get_data_v100 (texto sin categorías, float64, raw_price_str precalculado)
+# - "compact": order_store.read_orders
+# Un acierto de st.cache_data deserializa el pickle en cada rerun; st.cache_resource devuelve el mismo objeto.
+
+def legacy_frame(con):
+    df = pd.read_sql_query(f"SELECT {', '.join(order_store.ORDER_COLUMNS)} FROM orders", con)
+    df["date"] = pd.to_datetime(df["date"]); df["raw_price_str"] = format_raw_price(df["raw_price_val"], df["currency_code"])
+    return df
+
+def measure(df, repeat=5):
+    blob = pickle.dumps(df, protocol=pickle.HIGHEST_PROTOCOL); best = float("inf")
+    for _ in range(repeat): t = time.perf_counter(); pickle.loads(blob); best = min(best, time.perf_counter() - t)
+    return {"mb": round(df.memory_usage(deep=True).sum() / 2**20, 2), "pickle_mb": round(len(blob) / 2**20, 2), "cache_data_hit_s": round(best, 4)}
+
+def run(n_orders, workdir=None):
+    df, cost_map = synthetic_input(n_orders); df = enrich_orders(df, cost_map)
+    db = os.path.join(workdir or tempfile.mkdtemp(prefix="bench_mem_"), f"mem_{n_orders}.db"); con = order_store.connect(db)
+    try:
+        with con: order_store.upsert_orders(con, df)
+        legacy = legacy_frame(con); compact = order_store.read_orders(con)
+    finally: con.close()
+    res = {"orders": len(compact), "legacy": measure(legacy), "compact": measure(compact)}
+    res["reduction"] = round(res["legacy"]["mb"] / max(res["compact"]["mb"], 1e-9), 2)
+    res["dtypes"] = {c: str(t) for c, t in compact.dtypes.items()}
+    return res
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Memoria del frame de pedidos")
+    ap.add_argument("--orders", type=int, nargs="+", default=[25000, 100000]); ap.add_argument("--out", help="Fichero JSON de resultados")
+    a = ap.parse_args(); results = []
+    for n in a.orders:
+        r = run(n); results.append(r)
+        print(f"{r['orders']:>7} pedidos | legacy {r['legacy']['mb']:8.2f} MB (hit cache_data {r['legacy']['cache_data_hit_s']*1000:7.1f} ms) | "
+              f"compacto {r['compact']['mb']:8.2f} MB (hit cache_data {r['compact']['cache_data_hit_s']*1000:7.1f} ms, cache_resource 0 ms) | x{r['reduction']}")
+    if a.out:
+        with open(a.out, "w") as f: json.dump(results, f, indent=2)
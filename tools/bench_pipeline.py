@@ -0,0 +1,132 @@
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+import tempfile
+import subprocess
+from datetime import timedelta
+import pandas as pd
+from tools.fake_shopify import FakeShop, serve
+import local_db
+import metrics
+import order_store
+import inventory
+import rollups
+import product_cache
+from data_engine import fetch_orders, fetch_orders_sharded, order_shards, OrderBuffer, fetch_product_details_batch, enrich_orders, parse_product_node, ENRICH_COLS
+from charts import plot_bar_smart
+from tables import sales_table_styler
+
+# ==============================================================================
+# BENCHMARK DEL PIPELINE POR ETAPAS (FAKE SHOPIFY LOCAL)
+# ==============================================================================
+# python -m tools.bench_pipeline --orders 1000 25000 100000 --out bench.json [--compare base.json]
+# Cada tamaño usa una base SQLite nueva (caché de producto fría) y un servidor local con datos sintéticos deterministas.
+# El cubo de coste GraphQL del servidor es ilimitado: se mide el cliente, no la cuota de la tienda.
+# python -m tools.bench_pipeline --check: comprobación automática del enriquecimiento contra el mismo servidor (exit 1 si falla).
+STAGES = ["fetch", "fetch_sharded", "normalize", "enrich_fetch", "enrich_cached", "margins", "store", "aggregate", "figures", "table_style", "inventory", "sync_cold", "sync_delta"]
+CHART_DIMS = [("channel", "v", None), ("clean_mp", "v", 5), ("type", "h", None), ("brand", "h", 5), ("country", "h", None), ("price_band", "v", None)]
+
+class _Labels(dict):
+    # Sustituto de la tabla de traducciones de la app: cada clave es su propia etiqueta
+    def __missing__(self, k): return k
+
+def _timed(res, name, fn, *args, **kw):
+    t = time.perf_counter(); out = fn(*args, **kw); res[name] = round(time.perf_counter() - t, 4)
+    return out
+
+def _git_rev():
+    try: return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError): return None
+
+def run(n_orders, days=365, seed=42, workdir=None):
+    shop = FakeShop(n_orders, days=days, seed=seed); shop.cost_restore = 1e9; server, url = serve(shop)
+    workdir = workdir or tempfile.mkdtemp(prefix="bench_"); old_db = local_db.DB_PATH
+    res = {}; start = (shop.now - timedelta(days=days + 1)).replace(tzinfo=None) # la app pasa fechas sin zona
+    try:
+        local_db.DB_PATH = os.path.join(workdir, f"stages_{n_orders}.db")
+        raw, complete = _timed(res, "fetch", fetch_orders, url, "x", created_at_min=start)
+        _timed(res, "fetch_sharded", fetch_orders_sharded, url, "x", order_shards(start))
+        df = _timed(res, "normalize", lambda: OrderBuffer().extend(raw).frame()); pids = df["parent_id"].dropna().unique().tolist()
+        cost_map = _timed(res, "enrich_fetch", fetch_product_details_batch, pids, url, "x")
+        _timed(res, "enrich_cached", fetch_product_details_batch, pids, url, "x")
+        df = _timed(res, "margins", enrich_orders, df, cost_map)
+        con = order_store.connect()
+        try:
+            with con: _timed(res, "store", order_store.upsert_orders, con, df)
+            cube = _timed(res, "aggregate", lambda: (lambda c: {d: rollups.count_by(c, d) for d, _, _ in CHART_DIMS})(rollups.read_rollup(con)))
+        finally: con.close()
+        _timed(res, "figures", lambda: [plot_bar_smart(cube[d], d, "c", orientation=o, limit=lim) for d, o, lim in CHART_DIMS])
+        paid = df[df["status"] == "paid"].sort_values("date", ascending=True).reset_index(drop=True)
+        paid["margin_cum"] = paid["margin_real"].cumsum(); paid = paid.sort_values("date", ascending=False).reset_index(drop=True); paid["#"] = range(len(paid), 0, -1)
+        _timed(res, "table_style", lambda: sales_table_styler(paid, _Labels())._compute()) # lo que hace st.dataframe con un Styler
+        _timed(res, "inventory", lambda: inventory.add_pricing_columns(inventory.get_current_stock_and_pricing(url, "x")))
+        # Extremo a extremo como get_data_v100: base vacía (backfill) y después sólo el delta
+        local_db.DB_PATH = os.path.join(workdir, f"sync_{n_orders}.db")
+        _timed(res, "sync_cold", lambda: (order_store.sync_orders(start, url, "x"), order_store.load_orders(start)))
+        _timed(res, "sync_delta", lambda: (order_store.sync_orders(start, url, "x"), order_store.load_orders(start)))
+    finally: local_db.DB_PATH = old_db; server.shutdown()
+    return {"orders": n_orders, "rows": len(df), "products": len(pids), "fetch_complete": complete, "stages": res, "http": dict(shop.stats)}
+
+def _count(name): return sum(1 for s in metrics.REGISTRY.recent() if s["name"] == name)
+
+def check(n_products=120):
+    # -> {comprobación: (ok, detalle)}
+    # - Cubo de coste casi vacío + errores intermitentes: reintentos y espera del cubo hasta tener todos los productos, con su coste real.
+    # - Todas las consultas fallan: tras GQL_MAX_ATTEMPTS los productos quedan sin resolver (coste/margen NULL, no 0) y apuntados como fallidos,
+    #   y en el cubo cuentan como PENDING, fuera de los pedidos con margen;
+    #   la cobertura avanza igual, el ciclo siguiente no los vuelve a pedir y, caducado el fallo, sync_orders completa sus pedidos.
+    res = {}; workdir = tempfile.mkdtemp(prefix="check_")
+    shop = FakeShop(n_products, n_products=n_products); shop.cost_available = 60.0; shop.cost_restore = 200.0; shop.graphql_error_every = 4; server, url = serve(shop)
+    try:
+        pids = [str(p) for p in shop.products]; throttled = _count("shopify.graphql.throttled")
+        got = fetch_product_details_batch(pids, url, "x", db_path=os.path.join(workdir, "retry.db")); throttled = _count("shopify.graphql.throttled") - throttled
+        wrong = [pid for pid in pids if pid not in got or got[pid]["cost"] != parse_product_node(shop.product_node(shop.products[int(pid)]))["cost"]]
+        res["throttle_retry_complete"] = (not wrong and throttled > 0, f"{len(got)}/{len(pids)} productos, {len(wrong)} mal, {throttled} THROTTLED, {shop.stats['graphql_calls']} llamadas")
+        shop.graphql_error_every = 1; db = os.path.join(workdir, "down.db"); start = (shop.now - timedelta(days=366)).replace(tzinfo=None)
+        order_store.sync_orders(start, url, "x", db_path=db); df = order_store.load_orders(start, db_path=db)
+        with_pid = df["parent_id"].astype(object).fillna("").ne("").to_numpy(); pending = df.loc[with_pid, [c for c in ENRICH_COLS if c != "commission"]]
+        covered = order_store.coverage_start(db) is not None
+        res["unresolved_left_null"] = (covered and len(pending) > 0 and pending.isna().all().all(), f"cobertura={covered}, {len(pending)} pedidos, coste {df['cost'].tolist()[:3]}...")
+        cube = order_store.load_rollup(db_path=db); by_brand = rollups.count_by(cube, "brand").set_index("brand")["c"]
+        n_pending = int(by_brand.get(rollups.PENDING, 0)); n_enr = int(cube["ventas_enr"].sum())
+        res["cube_pending_bucket"] = (n_pending == len(pending) and by_brand.sum() == len(df) and n_enr == len(df) - n_pending, f"{n_pending} {rollups.PENDING}, {by_brand.sum()}/{len(df)} en el gráfico de marcas, {n_enr} con margen")
+        calls = shop.stats["graphql_calls"]; order_store.sync_orders(start, url, "x", db_path=db)
+        res["failed_not_retried"] = (shop.stats["graphql_calls"] == calls, f"{shop.stats['graphql_calls'] - calls} llamadas GraphQL en el ciclo siguiente")
+        shop.graphql_error_every = 0; ttl = product_cache.PRODUCT_FAILED_TTL; product_cache.PRODUCT_FAILED_TTL = 0
+        try: order_store.sync_orders(start, url, "x", db_path=db)
+        finally: product_cache.PRODUCT_FAILED_TTL = ttl
+        df = order_store.load_orders(start, db_path=db); left = int(df.loc[with_pid, "margin_real"].isna().sum())
+        res["failed_retried_after_ttl"] = (left == 0, f"{left} pedidos sin margen tras caducar el fallo")
+    finally: server.shutdown()
+    return res
+
+def compare(results, baseline):
+    base = {r["orders"]: r["stages"] for r in baseline.get("results", [])}
+    for r in results:
+        b = base.get(r["orders"])
+        if not b: continue
+        print(f"\n{r['orders']:,} pedidos vs {baseline.get('git_rev') or 'base'}")
+        for s in STAGES:
+            if s in r["stages"] and b.get(s): print(f"  {s:14} {b[s]:9.3f}s -> {r['stages'][s]:9.3f}s  x{b[s] / max(r['stages'][s], 1e-9):.2f}")
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Benchmark del pipeline de datos por etapas")
+    ap.add_argument("--orders", type=int, nargs="+", default=[1000, 25000, 100000]); ap.add_argument("--days", type=int, default=365)
+    ap.add_argument("--out", help="Fichero JSON de resultados"); ap.add_argument("--compare", help="JSON de una ejecución anterior"); ap.add_argument("--check", action="store_true")
+    a = ap.parse_args(); results = []
+    if a.check:
+        res = check()
+        for name, (ok, detail) in res.items(): print(f"{'OK' if ok else 'KO'} {name}: {detail}")
+        sys.exit(0 if all(ok for ok, _ in res.values()) else 1)
+    for n in a.orders:
+        r = run(n, a.days); results.append(r)
+        print(f"{n:>7,} pedidos | " + " | ".join(f"{s} {r['stages'][s]:.3f}s" for s in STAGES if s in r["stages"]), file=sys.stderr)
+    report = {"git_rev": _git_rev(), "timestamp": pd.Timestamp.now(tz="UTC").isoformat(), "python": platform.python_version(), "pandas": pd.__version__, "results": results}
+    if a.out:
+        with open(a.out, "w") as f: json.dump(report, f, indent=2)
+    else: print(json.dumps(report, indent=2))
+    if a.compare:
+        with open(a.compare) as f: compare(results, json.load(f))
@@ -0,0 +1,216 @@
+import json
+import random
+import re
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs, urlencode
+
+# ==============================================================================
+# FAKE SHOPIFY (REST + GRAPHQL) PARA PRUEBAS LOCALES Y BENCHMARKS
+# ==============================================================================
+# python -m tools.fake_shopify --orders 5000 --port 8765
+# -> secrets: shop_url = "http://127.0.0.1:8765"
+MP_TAGS = ["", "", "", "decathlon", "alltricks", "refurbed", "campsider", "ebikemood", "buycycle", "marketplace", "venta asistida"]
+CURRENCIES = ["EUR"] * 12 + ["PLN", "HUF", "GBP", "RON"]
+COUNTRIES = ["ES", "ES", "ES", "FR", "DE", "IT", "PT", "BE", "NL", "PL"]
+FISCAL = ["REBU", "REBU", "PRO", "INTRA"]
+SUBCATS = ["Carretera", "Gravel", "Doble suspensión", "Rígida", "Urbana", "MTB eléctrica"]
+BRANDS = ["Specialized", "Trek", "Canyon", "Orbea", "Scott", "Cannondale", "Giant", "BH"]
+
+def iso(dt): return dt.astimezone(timezone.utc).strftime("%Y-%m-%dT%H:%M:%S+00:00")
+
+def parse_ts(s):
+    dt = datetime.fromisoformat(s.replace("Z", "+00:00"))
+    return dt if dt.tzinfo else dt.replace(tzinfo=timezone.utc)
+
+class FakeShop:
+    def __init__(self, n_orders=1000, n_products=None, days=365, seed=42, now=None):
+        rnd = random.Random(seed); self.now = now or datetime.now(timezone.utc).replace(microsecond=0)
+        n_products = n_products or max(50, n_orders)
+        self.products = {}
+        for i in range(n_products):
+            pid = 7000000 + i; created = self.now - timedelta(days=rnd.randint(1, days + 400), minutes=rnd.randint(0, 1440))
+            motor = rnd.random() < 0.25
+            self.products[pid] = {
+                "id": pid, "title": f"{rnd.choice(BRANDS)} Bike {i}", "vendor": rnd.choice(BRANDS), "createdAt": iso(created), "updatedAt": iso(created + timedelta(days=rnd.randint(0, 30))),
+                "sku": f"{rnd.choice('25')}{i:05d}"[-6:], "price": float(rnd.randrange(600, 6000, 10)), "compareAtPrice": None,
+                "totalInventory": rnd.choice([0, 1, 1, 1]), "tags": ["bici_market"] if rnd.random() < 0.03 else [], "status": "ACTIVE",
+                "meta": {"custitem_preciocompra": str(rnd.randrange(300, 4000, 5)), "cseg_origenfiscal": rnd.choice(FISCAL), "cseg_subcategoria": rnd.choice(SUBCATS),
+                         "cseg_all_marca": rnd.choice(BRANDS).lower(), "cseg_motor": "Bosch CX" if motor else None, "custitem_kilometraje": str(rnd.randint(10, 3000)) if motor else None,
+                         "custitem_all_estado": "Muy bueno", "custitem_all_anodelmodelo": str(rnd.randint(2016, 2024)), "cseg_talla": rnd.choice(["S", "M", "L"])},
+            }
+            if rnd.random() < 0.3: self.products[pid]["compareAtPrice"] = self.products[pid]["price"] + 200
+        pids = list(self.products)
+        self.orders = []
+        for i in range(n_orders):
+            created = self.now - timedelta(days=days * (i / max(1, n_orders)), minutes=rnd.randint(0, 600))
+            pid = rnd.choice(pids); p = self.products[pid]; cur = rnd.choice(CURRENCIES)
+            price = p["price"] * {"EUR": 1, "PLN": 4.3, "HUF": 400, "GBP": 0.85, "RON": 5}[cur]
+            status = rnd.choices(["paid", "pending", "partially_refunded", "refunded"], [85, 10, 3, 2])[0]
+            self.orders.append({
+                "id": 5000000000 + i, "name": f"#TV{100000 + i}", "created_at": iso(created), "updated_at": iso(created + timedelta(hours=rnd.randint(0, 48))),
+                "tags": rnd.choice(MP_TAGS), "total_price": f"{price:.2f}", "currency": cur, "total_discounts": str(rnd.choice([0, 0, 0, 50, 100])),
+                "financial_status": status, "fulfillment_status": rnd.choice([None, "fulfilled"]), "cancelled_at": iso(created) if rnd.random() < 0.02 else None,
+                "shipping_address": {"country_code": rnd.choice(COUNTRIES)}, "line_items": [{"sku": p["sku"], "product_id": pid, "title": p["title"]}],
+            })
+        self.orders.sort(key=lambda o: o["created_at"], reverse=True)
+        self.lock = threading.Lock(); self.stats = {"rest_calls": 0, "graphql_calls": 0, "bytes": 0}
+        self.bulk_ops = []; self.bulk_files = {}; self.base_url = ""; self._filtered = {}
+        self.latency = 0.0; self.throttle_every = 0; self.fail_every = 0; self.graphql_error_every = 0; self.cost_available = 1000.0; self.cost_restore = 50.0; self._last_restore = time.time()
+
+    # --- REST ---
+    def list_orders(self, qs):
+        limit = int(qs.get("limit", ["50"])[0]); offset = int(qs.get("page_info", ["0"])[0])
+        key = tuple(qs.get(k, [None])[0] for k in ("created_at_min", "created_at_max", "updated_at_min")) + (len(self.orders),)
+        rows = self._filtered.get(key) if offset else None # mismo filtro en todas las páginas: no recorrer 100k pedidos por página
+        if rows is None:
+            rows = self.orders
+            if "created_at_min" in qs: m = parse_ts(qs["created_at_min"][0]); rows = [o for o in rows if parse_ts(o["created_at"]) >= m]
+            if "created_at_max" in qs: m = parse_ts(qs["created_at_max"][0]); rows = [o for o in rows if parse_ts(o["created_at"]) <= m]
+            if "updated_at_min" in qs: m = parse_ts(qs["updated_at_min"][0]); rows = [o for o in rows if parse_ts(o["updated_at"]) >= m]
+            self._filtered[key] = rows
+            if len(self._filtered) > 32: self._filtered.pop(next(iter(self._filtered))) # tramos en paralelo: varios filtros vivos a la vez
+        page = rows[offset:offset + limit]; nxt = offset + limit if offset + limit < len(rows) else None
+        return page, nxt
+
+    # --- GRAPHQL ---
+    def product_node(self, p):
+        def mf(key): v = p["meta"].get(key); return {"value": v} if v is not None else None
+        return {"title": p["title"], "status": p["status"], "vendor": p["vendor"], "createdAt": p["createdAt"], "updatedAt": p["updatedAt"], "tags": p["tags"], "totalInventory": p["totalInventory"],
+                "featuredImage": {"url": f"https://cdn.example.com/{p['id']}.jpg"}, "id": f"gid://shopify/Product/{p['id']}",
+                "variants": {"edges": [{"node": {"price": f"{p['price']:.2f}", "compareAtPrice": f"{p['compareAtPrice']:.2f}" if p["compareAtPrice"] else None, "sku": p["sku"]}}]},
+                "metafield": mf("custitem_preciocompra"), "fiscal": mf("cseg_origenfiscal"), "modal": None, "subcat": mf("cseg_subcategoria"), "km": mf("custitem_kilometraje"),
+                "motor": mf("cseg_motor"), "brand_real": mf("cseg_all_marca"),
+                "m_cost": mf("custitem_preciocompra"), "m_fiscal": mf("cseg_origenfiscal"), "m_state": mf("custitem_all_estado"), "m_year": mf("custitem_all_anodelmodelo"),
+                "m_size": mf("cseg_talla"), "m_size_rec": None, "m_frame": None, "m_wheels": None, "m_speed": None, "m_speed_cass": None, "m_plate": None, "m_brakes": None,
+                "m_motor": mf("cseg_motor"), "m_battery": None, "m_km": mf("custitem_kilometraje")}
+
+    # --- BULK OPERATIONS ---
+    def bulk_lines(self, inner_query):
+        lo = re.search(r"created_at:>='([^']+)'", inner_query); hi = re.search(r"created_at:<='([^']+)'", inner_query)
+        lo = parse_ts(lo.group(1)) if lo else None; hi = parse_ts(hi.group(1)) if hi else None
+        for o in self.orders:
+            ts = parse_ts(o["created_at"])
+            if (lo and ts < lo) or (hi and ts > hi): continue
+            gid = f"gid://shopify/Order/{o['id']}"
+            yield json.dumps({"id": gid, "name": o["name"], "createdAt": o["created_at"], "updatedAt": o["updated_at"], "tags": [t for t in o["tags"].split(", ") if t],
+                              "cancelledAt": o["cancelled_at"], "displayFinancialStatus": o["financial_status"].upper(), "displayFulfillmentStatus": (o["fulfillment_status"] or "unfulfilled").upper(),
+                              "totalPriceSet": {"shopMoney": {"amount": o["total_price"], "currencyCode": o["currency"]}}, "totalDiscountsSet": {"shopMoney": {"amount": o["total_discounts"], "currencyCode": o["currency"]}},
+                              "shippingAddress": {"countryCodeV2": o["shipping_address"]["country_code"]}})
+            for i, li in enumerate(o["line_items"]):
+                p = self.products.get(li["product_id"])
+                yield json.dumps({"id": f"gid://shopify/LineItem/{o['id']}{i}", "sku": li["sku"], "product": self.product_node(p) if p else None, "__parentId": gid})
+
+    def bulk(self, query, variables):
+        if "bulkOperationRunQuery" in query:
+            n = len(self.bulk_ops) + 1; op = {"id": f"gid://shopify/BulkOperation/{n}", "polls": 0, "lines": list(self.bulk_lines(variables.get("q", "")))}
+            self.bulk_ops.append(op); self.bulk_files[str(n)] = op["lines"]
+            return {"bulkOperationRunQuery": {"bulkOperation": {"id": op["id"], "status": "CREATED"}, "userErrors": []}}
+        op = self.bulk_ops[-1] if self.bulk_ops else None
+        if not op: return {"currentBulkOperation": None}
+        op["polls"] += 1; done = op["polls"] >= 2; n = op["id"].rsplit("/", 1)[-1]
+        return {"currentBulkOperation": {"id": op["id"], "status": "COMPLETED" if done else "RUNNING", "errorCode": None, "objectCount": str(len(op["lines"])),
+                                         "url": f"{self.base_url}/bulk/{n}.jsonl" if done and op["lines"] else None}}
+
+    def graphql(self, query, variables=None):
+        if "bulkOperationRunQuery" in query or "currentBulkOperation" in query: return self.bulk(query, variables or {}), 10
+        aliases = re.findall(r'(p\d+): product\(id: "gid://shopify/Product/(\d+)"\)', query)
+        if aliases:
+            data = {}
+            for alias, pid in aliases:
+                p = self.products.get(int(pid)); data[alias] = self.product_node(p) if p else None
+            return data, len(aliases) * 4 + 1
+        nodes = re.search(r'nodes\(ids: \[(.*?)\]\)', query, re.S)
+        if nodes:
+            out = []
+            for pid in re.findall(r'Product/(\d+)', nodes.group(1)):
+                p = self.products.get(int(pid)); out.append({"id": f"gid://shopify/Product/{pid}", "updatedAt": p["updatedAt"]} if p else None)
+            return {"nodes": out}, len(out) // 10 + 1
+        m = re.search(r'products\((.*?)\)\s*\{', query, re.S)
+        if m:
+            args = m.group(1); first = int(re.search(r'first:\s*(\d+)', args).group(1))
+            q = re.search(r'query:\s*"([^"]*)"', args); q = q.group(1) if q else ""
+            after = re.search(r'after:\s*"([^"]*)"', args); offset = int(after.group(1)) if after else 0
+            rows = [p for p in self.products.values() if p["status"] == "ACTIVE" or "status:active" not in q]
+            sku = re.search(r'sku:(\S+)', q)
+            if sku: rows = [p for p in rows if p["sku"] == sku.group(1)]
+            upd = re.search(r"updated_at:>'?([^'\s]+)'?", q)
+            if upd: since = parse_ts(upd.group(1)); rows = [p for p in rows if parse_ts(p["updatedAt"]) > since]
+            rows.sort(key=lambda p: p["createdAt"])
+            page = rows[offset:offset + first]; has_next = offset + first < len(rows)
+            return {"products": {"pageInfo": {"hasNextPage": has_next, "endCursor": str(offset + first)}, "edges": [{"node": self.product_node(p)} for p in page]}}, first + 2
+        return {}, 1
+
+    def spend(self, cost):
+        # Seau de coût GraphQL (leaky bucket) façon Shopify
+        with self.lock:
+            now = time.time(); self.cost_available = min(1000.0, self.cost_available + (now - self._last_restore) * self.cost_restore); self._last_restore = now
+            ok = self.cost_available >= cost
+            if ok: self.cost_available -= cost
+            return ok, self.cost_available
+
+def make_handler(shop):
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args): pass
+
+        def send_json(self, code, payload, headers=None):
+            body = json.dumps(payload).encode()
+            with shop.lock: shop.stats["bytes"] += len(body)
+            self.send_response(code); self.send_header("Content-Type", "application/json"); self.send_header("Content-Length", str(len(body)))
+            for k, v in (headers or {}).items(): self.send_header(k, v)
+            self.end_headers(); self.wfile.write(body)
+
+        def maybe_fail(self, counter_key):
+            with shop.lock: shop.stats[counter_key] += 1; n = shop.stats[counter_key]
+            if shop.latency: time.sleep(shop.latency)
+            if shop.throttle_every and n % shop.throttle_every == 0: self.send_json(429, {"errors": "Exceeded 2 calls per second for api client. Reduce request rates to resume uninterrupted service."}, {"Retry-After": "0.1"}); return True
+            if shop.fail_every and n % shop.fail_every == 0: self.send_json(502, {"errors": "Bad gateway"}); return True
+            return False
+
+        def do_GET(self):
+            u = urlparse(self.path); qs = parse_qs(u.query)
+            if u.path.endswith("/orders.json"):
+                if self.maybe_fail("rest_calls"): return
+                page, nxt = shop.list_orders(qs); headers = {}
+                if nxt is not None:
+                    q2 = {k: v[0] for k, v in qs.items()}; q2["page_info"] = str(nxt)
+                    headers["Link"] = f'<http://{self.headers["Host"]}{u.path}?{urlencode(q2)}>; rel="next"'
+                return self.send_json(200, {"orders": page}, headers)
+            m = re.match(r"/bulk/(\d+)\.jsonl$", u.path)
+            if m and m.group(1) in shop.bulk_files:
+                body = ("\n".join(shop.bulk_files[m.group(1)]) + "\n").encode()
+                self.send_response(200); self.send_header("Content-Type", "application/jsonl"); self.send_header("Content-Length", str(len(body))); self.end_headers(); self.wfile.write(body); return
+            self.send_json(404, {"errors": "Not Found"})
+
+        def do_POST(self):
+            u = urlparse(self.path); body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            if u.path.endswith("/graphql.json"):
+                if self.maybe_fail("graphql_calls"): return
+                with shop.lock: n = shop.stats["graphql_calls"]
+                if shop.graphql_error_every and n % shop.graphql_error_every == 0: return self.send_json(200, {"errors": [{"message": "Internal error. Looks like something went wrong on our end."}], "data": None}) # 200 sin datos, como Shopify
+                data, cost = shop.graphql(body.get("query", ""), body.get("variables"))
+                ok, available = shop.spend(cost)
+                ext = {"cost": {"requestedQueryCost": cost, "actualQueryCost": cost if ok else None, "throttleStatus": {"maximumAvailable": 1000.0, "currentlyAvailable": available, "restoreRate": shop.cost_restore}}}
+                if not ok: return self.send_json(200, {"errors": [{"message": "Throttled", "extensions": {"code": "THROTTLED"}}], "extensions": ext})
+                return self.send_json(200, {"data": data, "extensions": ext})
+            self.send_json(404, {"errors": "Not Found"})
+    return Handler
+
+def serve(shop, port=0):
+    # Lance le serveur dans un thread; renvoie (server, base_url)
+    server = ThreadingHTTPServer(("127.0.0.1", port), make_handler(shop)); server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    shop.base_url = f"http://127.0.0.1:{server.server_address[1]}"
+    return server, shop.base_url
+
+if __name__ == "__main__":
+    import argparse
+    ap = argparse.ArgumentParser(description="Fake Shopify local")
+    ap.add_argument("--orders", type=int, default=1000); ap.add_argument("--days", type=int, default=365); ap.add_argument("--port", type=int, default=8765)
+    ap.add_argument("--latency", type=float, default=0.0)
+    a = ap.parse_args(); shop = FakeShop(a.orders, days=a.days); shop.latency = a.latency
+    server, url = serve(shop, a.port); print(f"Fake Shopify en {url} ({len(shop.orders)} pedidos, {len(shop.products)} productos)")
+    try: threading.Event().wait()
+    except KeyboardInterrupt: server.shutdown()
@@ -0,0 +1,135 @@
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import platform
+import resource
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+# ==============================================================================
+# PRUEBA DE CARGA: N SESIONES APPTEST CONCURRENTES CONTRA EL FAKE SHOPIFY
+# ==============================================================================
+# python -m tools.load_test --sessions 1 2 4 8 16 --rounds 2 --orders 5000 --latency 0.05 --out load.json [--slo 2.0] [--cold]
+# Un solo proceso, como el servidor de Streamlit: las sesiones son hilos y comparten st.cache_resource / st.cache_data,
+# el refresco en segundo plano y el almacén local (base nueva en un directorio temporal).
+# Cada sesión inicia sesión en el formulario, recorre las cinco páginas y, en Resultados, los modos de periodo; se mide cada rerun.
+# Salida: percentiles por página y nivel, reruns/s, memoria del proceso y la curva de escalado (sesiones -> p95 / reruns/s / RSS).
+PAGES = ["Resultados", "Evolución", "Tabla Ventas", "Margen & Dto", "Control Precios"]
+PERIODS = ["Mes Pasado", "Ayer", "Hoy", "Este Mes", "Este Año"] # "Personalizado" necesita fechas a mano: fuera
+MENU_KEY = "load_test_menu"
+PASSWORD = "load-test"
+APP_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "app.py")
+
+def _fake_option_menu(menu_title=None, options=(), default_index=0, **kw):
+    # El componente option_menu no se ejecuta en AppTest: cada sesión deja en su session_state las etiquetas que quiere
+    import streamlit as st
+    want = st.session_state.get(MENU_KEY, ())
+    return next((o for o in options if o in want), options[default_index])
+
+def _share_apptest_runtime():
+    # AppTest pone y quita en cada run un Runtime simulado global y recompila el script: con varias sesiones en hilos,
+    # el run que termina deja sin runtime a los demás. Como en el servidor real: un runtime y un ScriptCache para todo el proceso.
+    from streamlit.runtime import Runtime
+    from streamlit.runtime.scriptrunner.script_cache import ScriptCache
+    from streamlit.testing.v1 import app_test, local_script_runner
+    last = {}; cache = ScriptCache()
+    def instance(cls):
+        if cls._instance is not None: last["rt"] = cls._instance
+        if "rt" not in last: raise RuntimeError("Runtime hasn't been created!")
+        return cls._instance or last["rt"]
+    Runtime.instance = classmethod(instance); Runtime.exists = classmethod(lambda cls: cls._instance is not None or "rt" in last)
+    app_test.ScriptCache = local_script_runner.ScriptCache = lambda: cache # bytecode compilado una vez (ast.parse en paralelo falla en CPython 3.11)
+
+def rss_mb():
+    # -> (RSS actual, pico) del proceso en MB. /proc en Linux; sin él sólo el pico de getrusage.
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / (2**20 if sys.platform == "darwin" else 2**10)
+    try:
+        with open("/proc/self/statm") as f: return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20, peak
+    except (OSError, ValueError): return None, peak
+
+def _pct(a, q): return round(float(np.percentile(a, q)), 3) if len(a) else None
+
+class Session:
+    def __init__(self, app_path, shop_url, timeout):
+        from streamlit.testing.v1 import AppTest
+        self.at = AppTest.from_file(app_path, default_timeout=timeout); self.samples = []; self.errors = []
+        self.at.secrets["shopify"] = {"shop_url": shop_url, "access_token": "x"}; self.at.secrets["security"] = {"password": PASSWORD}
+
+    def _timed(self, label, fn):
+        t = time.perf_counter()
+        try: fn()
+        except Exception as e: self.errors.append(f"{label}: {e!r}"[:300]); return # AppTest propaga cualquier error del script: se cuenta, no se corta la prueba
+        self.samples.append((label, time.perf_counter() - t))
+        self.errors.extend(f"{label}: {e.value}"[:300] for e in self.at.exception)
+
+    def login(self):
+        self._timed("login", self.at.run)
+        if not self.at.session_state["password_correct"]:
+            self.at.text_input[1].input(PASSWORD); self._timed("login", self.at.button[0].click().run)
+
+    def visit(self, page, period="Este Mes"):
+        self.at.session_state[MENU_KEY] = (page, period); self._timed(page if page != PAGES[0] else f"{page} · {period}", self.at.run)
+        if page == "Margen & Dto" and self.at.selectbox and self.at.selectbox[0].options: # un SKU de la foto local (como el autocompletado)
+            sku = random.choice(self.at.selectbox[0].options).split(" · ")[0] # las opciones llegan con format_func ("sku · título"): el valor es el SKU
+            self._timed("Margen & Dto · SKU", self.at.selectbox[0].set_value(sku).run)
+
+    def script(self, rounds):
+        self.login()
+        for _ in range(rounds):
+            for period in PERIODS: self.visit(PAGES[0], period)
+            for page in PAGES[1:]: self.visit(page)
+        return self
+
+def run_level(n, rounds, app_path, shop_url, timeout):
+    # n sesiones a la vez -> muestras por etiqueta, errores, reruns/s y memoria al terminar
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=n) as ex: sessions = list(ex.map(lambda _: Session(app_path, shop_url, timeout).script(rounds), range(n)))
+    wall = time.perf_counter() - t0; rss, peak = rss_mb()
+    samples = [s for sess in sessions for s in sess.samples]; by = {}
+    for label, dt in samples: by.setdefault(label, []).append(dt)
+    allv = [dt for _, dt in samples]
+    return {"sessions": n, "reruns": len(samples), "wall_s": round(wall, 2), "reruns_per_s": round(len(samples) / wall, 2),
+            "p50_s": _pct(allv, 50), "p95_s": _pct(allv, 95), "p99_s": _pct(allv, 99), "max_s": round(max(allv), 3) if allv else None,
+            "rss_mb": round(rss, 1) if rss is not None else None, "peak_rss_mb": round(peak, 1), "errors": [e for sess in sessions for e in sess.errors][:20],
+            "pages": {k: {"n": len(v), "p50_s": _pct(v, 50), "p95_s": _pct(v, 95), "p99_s": _pct(v, 99), "max_s": round(max(v), 3)} for k, v in sorted(by.items())}}
+
+def load_test(levels, rounds=2, n_orders=5000, days=400, latency=0.0, cold=False, timeout=600, app_path=APP_PATH):
+    # Base y snapshots en un directorio temporal (antes de importar nada que lea TUVALUM_DATA_DIR): la prueba no toca .data/
+    work = tempfile.mkdtemp(prefix="load_test_"); os.environ["TUVALUM_DATA_DIR"] = work; os.environ["TUVALUM_SNAPSHOT_DIR"] = os.path.join(work, "snapshots")
+    import streamlit_option_menu; streamlit_option_menu.option_menu = _fake_option_menu
+    _share_apptest_runtime()
+    from tools.fake_shopify import FakeShop, serve
+    shop = FakeShop(n_orders, days=days); shop.cost_restore = 1e9; shop.latency = latency; server, url = serve(shop)
+    try:
+        warm = None
+        if not cold: # una sesión previa llena almacén y cachés: se mide el régimen estable, no el primer arranque
+            t = time.perf_counter(); Session(app_path, url, timeout).script(1); warm = round(time.perf_counter() - t, 2)
+        curve = []
+        for n in levels:
+            before = dict(shop.stats); r = run_level(n, rounds, app_path, url, timeout); r["shopify_calls"] = {k: shop.stats[k] - before[k] for k in ("rest_calls", "graphql_calls")}
+            curve.append(r)
+            print(f"{n:>4} sesiones | {r['reruns']:5} reruns {r['reruns_per_s']:7.2f}/s | p50 {r['p50_s']:.3f}s p95 {r['p95_s']:.3f}s p99 {r['p99_s']:.3f}s | RSS {r['rss_mb']} MB (pico {r['peak_rss_mb']}) | errores {len(r['errors'])}", file=sys.stderr)
+    finally: server.shutdown()
+    return {"orders": n_orders, "latency_s": latency, "rounds": rounds, "warmup_s": warm, "cpus": os.cpu_count(), "python": platform.python_version(), "curve": curve}
+
+def capacity(report, slo):
+    # -> mayor nivel medido con p95 <= slo (None si ni una sesión lo cumple)
+    ok = [r["sessions"] for r in report["curve"] if r["p95_s"] is not None and r["p95_s"] <= slo and not r["errors"]]
+    return max(ok) if ok else None
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Prueba de carga del dashboard con sesiones AppTest concurrentes")
+    ap.add_argument("--sessions", type=int, nargs="+", default=[1, 2, 4, 8]); ap.add_argument("--rounds", type=int, default=2)
+    ap.add_argument("--orders", type=int, default=5000); ap.add_argument("--days", type=int, default=400); ap.add_argument("--latency", type=float, default=0.0, help="Latencia por petición del fake Shopify (s)")
+    ap.add_argument("--cold", action="store_true", help="Sin sesión de calentamiento: la primera carga entra en la medida"); ap.add_argument("--slo", type=float, default=2.0, help="p95 objetivo por rerun (s)")
+    ap.add_argument("--timeout", type=float, default=600); ap.add_argument("--out", help="Fichero JSON de resultados")
+    a = ap.parse_args()
+    report = load_test(a.sessions, a.rounds, a.orders, a.days, a.latency, a.cold, a.timeout); report["slo_p95_s"] = a.slo; report["capacity_sessions"] = capacity(report, a.slo)
+    print(f"Capacidad (p95 <= {a.slo}s): {report['capacity_sessions']} sesiones", file=sys.stderr)
+    if a.out:
+        with open(a.out, "w") as f: json.dump(report, f, indent=2)
+    else: print(json.dumps(report, indent=2))
@@ -0,0 +1,46 @@
+import os
+import sys
+import json
+import time
+import argparse
+import tomllib
+import pandas as pd
+import local_db
+import order_store
+import inventory
+import snapshots
+from refresher import BackgroundRefresher
+from data_engine import order_window_start
+
+# ==============================================================================
+# PRECÁLCULO SIN STREAMLIT: ALMACÉN COMPLETO -> SNAPSHOT VERSIONADO
+# ==============================================================================
+# python -m tools.precompute [--start 2025-01-01] [--out snapshots] [--db .data/tuvalum.db]
+# Mismos cargadores que la app (BackgroundRefresher -> order_store / inventory): pedidos enriquecidos desde --start
+# (por defecto el 1 de enero del año pasado, lo que pide Evolución), cubo diario, inventario y caché de producto.
+# Credenciales: [shopify] de .streamlit/secrets.toml, o SHOPIFY_SHOP_URL / SHOPIFY_ACCESS_TOKEN.
+
+def shop_creds(secrets_path=os.path.join(".streamlit", "secrets.toml")):
+    url = os.environ.get("SHOPIFY_SHOP_URL"); token = os.environ.get("SHOPIFY_ACCESS_TOKEN")
+    if url and token: return url, token
+    with open(secrets_path, "rb") as f: s = tomllib.load(f)["shopify"]
+    return s["shop_url"], s["access_token"]
+
+def precompute(shop_url, token, start, db_path=None, snap_dir=None):
+    # -> (ruta del snapshot, manifiesto, segundos por etapa). La base de trabajo se reutiliza: una segunda pasada sólo pide el delta.
+    db_path = db_path or local_db.DB_PATH; ref = BackgroundRefresher(shop_url, token, db_path=db_path); res = {} # pedidos, inventario y caché de producto a la base de trabajo
+    t = time.perf_counter(); ref.refresh_orders(order_window_start(start)); res["orders"] = round(time.perf_counter() - t, 2)
+    t = time.perf_counter(); order_store.load_rollup(db_path=db_path); res["rollup"] = round(time.perf_counter() - t, 2) # cubo reconstruido si la base es anterior
+    t = time.perf_counter(); ref.refresh_inventory(); res["inventory"] = round(time.perf_counter() - t, 2)
+    if order_store.data_as_of(db_path) is None or inventory.data_as_of(db_path) is None: raise RuntimeError("Sincronización incompleta: no se escribe snapshot")
+    t = time.perf_counter(); path, manifest = snapshots.write_snapshot(db_path, snap_dir); res["snapshot"] = round(time.perf_counter() - t, 2)
+    return path, manifest, res
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Precalcula pedidos, cubo e inventario y escribe un snapshot para la app")
+    ap.add_argument("--start", default=f"{pd.Timestamp.now().year - 1}-01-01"); ap.add_argument("--out", default=snapshots.SNAPSHOT_DIR)
+    ap.add_argument("--db", default=local_db.DB_PATH, help="Base de trabajo (se conserva entre ejecuciones)"); ap.add_argument("--secrets", default=os.path.join(".streamlit", "secrets.toml"))
+    a = ap.parse_args()
+    try: path, manifest, res = precompute(*shop_creds(a.secrets), pd.Timestamp(a.start), a.db, a.out)
+    except (OSError, KeyError, RuntimeError) as e: print(f"KO: {e}", file=sys.stderr); sys.exit(1)
+    print(json.dumps({"snapshot": path, "seconds": res, **manifest}, indent=2))
@@ -0,0 +1,110 @@
+import os
+import sys
+import json
+import time
+import argparse
+import http.client
+import tempfile
+from datetime import datetime, timedelta, timezone
+import requests
+import pandas as pd
+from tools.fake_shopify import FakeShop, serve, iso
+import order_store
+from webhooks import WebhookReceiver, sign
+
+# ==============================================================================
+# POSTER DE WEBHOOKS GRABADOS (SUSTITUTO LOCAL DE SHOPIFY)
+# ==============================================================================
+# python -m tools.webhook_poster --record events.jsonl --orders 20         # graba eventos sacados del fake shop
+# python -m tools.webhook_poster --replay events.jsonl --url http://127.0.0.1:8790/webhooks --secret S
+# python -m tools.webhook_poster --demo                                   # fake shop + receptor + poster en local: latencia hasta el cubo
+# python -m tools.webhook_poster --check                                  # comprobación automática: firma mala -> 401, pedido y margen aplicados (exit 1 si falla)
+# Una línea JSONL por evento: {"topic": "orders/create", "payload": {...}} (payload con la forma REST de Shopify).
+
+def record_events(shop, n_orders=20, n_updates=5, n_products=3, now=None):
+    # Pedidos nuevos (hoy), pedidos existentes que pasan a pagados y productos cuyo precio cambia en el fake
+    now = now or datetime.now(timezone.utc).replace(microsecond=0); events = []; base = shop.orders[:max(n_orders, n_updates)]
+    for i, o in enumerate(base[:n_orders]):
+        events.append({"topic": "orders/create", "payload": {**o, "id": 6000000000 + i, "name": f"#TVW{i}", "created_at": iso(now - timedelta(minutes=i)), "updated_at": iso(now)}})
+    for o in base[:n_updates]: events.append({"topic": "orders/updated", "payload": {**o, "financial_status": "paid", "updated_at": iso(now)}})
+    for p in list(shop.products.values())[:n_products]:
+        p["price"] -= 50; p["updatedAt"] = iso(now)
+        events.append({"topic": "products/update", "payload": {"id": p["id"], "title": p["title"], "updated_at": p["updatedAt"], "variants": [{"sku": p["sku"], "price": f"{p['price']:.2f}"}]}})
+    return events
+
+def post_events(url, secret, events, session=None):
+    # -> códigos HTTP, en orden
+    s = session or requests.Session(); codes = []
+    for ev in events:
+        body = json.dumps(ev["payload"]).encode()
+        r = s.post(url, data=body, headers={"Content-Type": "application/json", "X-Shopify-Topic": ev["topic"], "X-Shopify-Hmac-Sha256": sign(body, secret)}, timeout=10)
+        codes.append(r.status_code)
+    return codes
+
+def wait_applied(rx, n, timeout=30):
+    t0 = time.perf_counter()
+    while rx.applied < n and time.perf_counter() - t0 < timeout: time.sleep(0.01)
+    return rx.applied >= n
+
+def demo(n_orders=2000, events=20):
+    # Todo en local: fake shop, base nueva, receptor en un puerto libre; mide POST -> pedido en el cubo
+    shop = FakeShop(n_orders, days=30); shop.cost_restore = 1e9; server, url = serve(shop)
+    db = os.path.join(tempfile.mkdtemp(prefix="webhooks_"), "demo.db"); versions = []
+    try:
+        order_store.sync_orders(pd.Timestamp.now().normalize() - pd.Timedelta(days=30), url, "x", db)
+        rx = WebhookReceiver("demo-secret", url, "x", on_change=lambda: versions.append(time.perf_counter()), db_path=db).start("127.0.0.1", 0)
+        evs = record_events(shop, events, 5, 3); hook = f"http://127.0.0.1:{rx.port}/webhooks"
+        bad = post_events(hook, "otro-secreto", evs[:1])
+        t0 = time.perf_counter(); codes = post_events(hook, "demo-secret", evs); wait_applied(rx, len(evs))
+        rx.stop(); today = order_store.load_rollup(pd.Timestamp.now().normalize(), db_path=db)
+        return {"events": len(evs), "codes": sorted(set(codes)), "bad_signature": bad, "applied": rx.applied, "rejected": rx.rejected, "last_error": repr(rx.last_error) if rx.last_error else None,
+                "seconds_to_applied": round((versions[-1] if versions else time.perf_counter()) - t0, 3), "orders_today": int(today["ventas"].sum()) if not today.empty else 0}
+    finally: server.shutdown()
+
+def check(n_orders=300):
+    # -> {comprobación: (ok, detalle)}. Eventos grabados contra fake shop + receptor + base nuevos:
+    # firma mala -> 401 y nada aplicado; orders/updated -> fila actualizada en la base; products/update con coste nuevo -> margen de sus pedidos recalculado
+    shop = FakeShop(n_orders, days=30); shop.cost_restore = 1e9; server, url = serve(shop)
+    db = os.path.join(tempfile.mkdtemp(prefix="webhooks_"), "check.db"); secret = "check-secret"; res = {}
+    def row(q, *args):
+        con = order_store.connect(db)
+        try: return con.execute(q, args).fetchone()
+        finally: con.close()
+    try:
+        order_store.sync_orders(pd.Timestamp.now().normalize() - pd.Timedelta(days=31), url, "x", db)
+        rx = WebhookReceiver(secret, url, "x", db_path=db).start("127.0.0.1", 0); hook = f"http://127.0.0.1:{rx.port}/webhooks"; now = datetime.now(timezone.utc).replace(microsecond=0)
+        o = next(o for o in shop.orders if o["financial_status"] == "pending" and row("SELECT 1 FROM orders WHERE order_id = ?", o["id"]))
+        upd = {"topic": "orders/updated", "payload": {**o, "financial_status": "paid", "updated_at": iso(now)}}
+        codes = post_events(hook, "otro-secreto", [upd]); time.sleep(0.2)
+        res["bad_hmac_401"] = (codes == [401] and rx.rejected == 1 and rx.received == 0 and row("SELECT status FROM orders WHERE order_id = ?", o["id"])[0] == "pending", f"codes={codes} rejected={rx.rejected}")
+        c = http.client.HTTPConnection("127.0.0.1", rx.port, timeout=5); c.request("POST", "/webhooks", body=b"", headers={"Content-Length": "-1", "X-Shopify-Topic": "orders/create"}); code = c.getresponse().status; c.close()
+        bad = post_events(hook, secret, [{"topic": "orders/create", "payload": [o]}])
+        res["malformed_400"] = (code == 400 and bad == [400] and rx.alive(), f"Content-Length -1 -> {code}, cuerpo no objeto -> {bad}, hilo vivo={rx.alive()}")
+        codes = post_events(hook, secret, [upd]); ok = wait_applied(rx, 1); st = row("SELECT status, updated_at FROM orders WHERE order_id = ?", o["id"])
+        res["orders_updated_upsert"] = (codes == [200] and ok and st[0] == "paid" and pd.Timestamp(st[1]) == pd.Timestamp(now), f"codes={codes} fila={st}")
+        pid, p = next((pid, p) for pid, p in shop.products.items() if row("SELECT COUNT(*) FROM orders WHERE parent_id = ? AND margin_real != 0", str(pid))[0])
+        before = row("SELECT cost, margin_real, total_ttc FROM orders WHERE parent_id = ? AND margin_real != 0", str(pid)); new_cost = before[0] + 100
+        p["meta"]["custitem_preciocompra"] = str(new_cost); p["updatedAt"] = iso(now)
+        codes = post_events(hook, secret, [{"topic": "products/update", "payload": {"id": pid, "title": p["title"], "updated_at": p["updatedAt"]}}]); ok = wait_applied(rx, 2)
+        after = row("SELECT cost, margin_real FROM orders WHERE parent_id = ? AND margin_real != 0", str(pid))
+        res["products_update_reprice"] = (codes == [200] and ok and after[0] == new_cost and after[1] < before[1], f"codes={codes} coste {before[0]}->{after[0]} margen {before[1]}->{after[1]}")
+        rx.stop()
+    finally: server.shutdown()
+    return res
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Webhooks Shopify grabados -> receptor local")
+    ap.add_argument("--record", help="JSONL donde grabar eventos del fake shop"); ap.add_argument("--replay", help="JSONL de eventos a enviar")
+    ap.add_argument("--url", default="http://127.0.0.1:8790/webhooks"); ap.add_argument("--secret", default=os.environ.get("SHOPIFY_WEBHOOK_SECRET", ""))
+    ap.add_argument("--orders", type=int, default=20); ap.add_argument("--demo", action="store_true"); ap.add_argument("--check", action="store_true")
+    a = ap.parse_args()
+    if a.demo: print(json.dumps(demo(events=a.orders), indent=2))
+    elif a.check:
+        res = check()
+        for name, (ok, detail) in res.items(): print(f"{'OK' if ok else 'KO'} {name}: {detail}")
+        sys.exit(0 if all(ok for ok, _ in res.values()) else 1)
+    elif a.record:
+        with open(a.record, "w") as f: f.writelines(json.dumps(ev) + "\n" for ev in record_events(FakeShop(), a.orders))
+    elif a.replay:
+        with open(a.replay) as f: print(post_events(a.url, a.secret, [json.loads(l) for l in f if l.strip()]))
+    else: ap.print_help()
@@ -0,0 +1,99 @@
+import os
+import hmac
+import json
+import queue
+import base64
+import hashlib
+import logging
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import metrics
+import order_store
+import inventory
+from data_engine import build_order_frame
+
+# ==============================================================================
+# RECEPTOR DE WEBHOOKS SHOPIFY (ORDERS/CREATE, ORDERS/UPDATED, PRODUCTS/UPDATE)
+# ==============================================================================
+# Opcional: sólo arranca con [shopify] webhook_secret en secrets. Shopify -> POST http://<host>:TUVALUM_WEBHOOK_PORT/webhooks
+# - Se verifica X-Shopify-Hmac-Sha256 sobre el cuerpo tal cual; se responde 200 en el acto y se aplica en un hilo aparte.
+#   Si ese hilo no está vivo se responde 503: Shopify reintenta más tarde en vez de dar el evento por entregado.
+# - Pedidos: misma normalización y margen que la sincronización (build_order_frame), upsert + días del cubo tocados.
+# - Productos: foto de inventario y caché de producto de ese producto, y margen de sus pedidos recalculado.
+# Tras cada lote se llama a on_change (BackgroundRefresher.bump): las cachés de la app cambian de versión sin volver a pedir nada.
+WEBHOOK_PORT = int(os.environ.get("TUVALUM_WEBHOOK_PORT", 8790))
+WEBHOOK_TOPICS = ("orders/create", "orders/updated", "products/update")
+WEBHOOK_MAX_BYTES = 2 * 2**20
+log = logging.getLogger(__name__)
+
+def sign(body, secret): return base64.b64encode(hmac.new(secret.encode(), body, hashlib.sha256).digest()).decode()
+
+def verify(body, signature, secret): return bool(signature) and hmac.compare_digest(sign(body, secret), signature)
+
+class WebhookReceiver:
+    def __init__(self, secret, shop_url, token, on_change=None, db_path=None):
+        self.secret = secret; self.shop_url = shop_url; self.token = token; self.on_change = on_change; self.db_path = db_path
+        self.queue = queue.Queue(); self.server = None; self.port = None; self._worker = None
+        self.received = 0; self.rejected = 0; self.applied = 0; self.last_error = None
+
+    def alive(self): return self._worker is not None and self._worker.is_alive()
+
+    def submit(self, topic, payload):
+        # -> False (sin encolar) si el hilo que aplica no está vivo
+        if not self.alive(): return False
+        self.received += 1; self.queue.put((topic, payload)); return True
+
+    def apply(self, events):
+        # Lote de (topic, payload) -> almacén local
+        orders = [p for t, p in events if t.startswith("orders/")]; products = [str(p["id"]) for t, p in events if t == "products/update"]
+        with metrics.span("webhook.apply", orders=len(orders), products=len(products)):
+            if orders:
+                df_new, dropped, _ = build_order_frame(list({o["id"]: o for o in orders}.values()), self.shop_url, self.token, self.db_path) # mismo pedido varias veces en el lote: el último
+                con = order_store.connect(self.db_path)
+                try:
+                    with con: order_store.upsert_orders(con, order_store.newer_only(con, df_new), dropped)
+                finally: con.close()
+            if products: inventory.update_products(products, self.shop_url, self.token, self.db_path); order_store.reprice_orders(products, self.db_path)
+        self.applied += len(events)
+        if self.on_change: self.on_change()
+
+    def _loop(self):
+        while True:
+            events = [self.queue.get()]
+            while not self.queue.empty() and len(events) < 250: events.append(self.queue.get_nowait()) # ráfaga: un solo upsert
+            try: self.apply(events); self.last_error = None
+            except Exception as e: self.last_error = e; log.exception("Webhooks KO (%d eventos, la sincronización los recuperará)", len(events)) # cualquier fallo: el único hilo que aplica no puede morir
+
+    def handler(self):
+        receiver = self
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args): pass
+
+            def reply(self, code): self.send_response(code); self.send_header("Content-Length", "0"); self.end_headers()
+
+            def do_POST(self):
+                with metrics.span("webhook.receive") as sp:
+                    try: n = int(self.headers.get("Content-Length", 0))
+                    except ValueError: return self.reply(400)
+                    sp["bytes"] = n
+                    if n < 0: return self.reply(400) # rfile.read(-1) esperaría a que el cliente cierre, antes de comprobar la firma
+                    if n > WEBHOOK_MAX_BYTES: return self.reply(413)
+                    body = self.rfile.read(n); topic = self.headers.get("X-Shopify-Topic", "")
+                    if not verify(body, self.headers.get("X-Shopify-Hmac-Sha256"), receiver.secret): receiver.rejected += 1; sp["rejected"] += 1; return self.reply(401)
+                    if topic in WEBHOOK_TOPICS:
+                        try: payload = json.loads(body)
+                        except ValueError: return self.reply(400)
+                        if not isinstance(payload, dict) or "id" not in payload: return self.reply(400)
+                        if not receiver.submit(topic, payload): return self.reply(503)
+                    self.reply(200) # tema no suscrito: 200 igualmente, si no Shopify reintenta
+        return Handler
+
+    def start(self, host="0.0.0.0", port=WEBHOOK_PORT):
+        # -> self. OSError si el puerto está ocupado.
+        if not self.alive(): self._worker = threading.Thread(target=self._loop, name="tuvalum-webhooks-apply", daemon=True); self._worker.start() # antes de aceptar peticiones
+        self.server = ThreadingHTTPServer((host, port), self.handler()); self.server.daemon_threads = True; self.port = self.server.server_address[1]
+        threading.Thread(target=self.server.serve_forever, name="tuvalum-webhooks", daemon=True).start()
+        return self
+
+    def stop(self):
+        if self.server: self.server.shutdown(); self.server.server_close()